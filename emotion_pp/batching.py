@@ -0,0 +1,96 @@
+"""
+Динамический микро-батчинг для классификатора эмоций.
+"""
+
+from __future__ import annotations
+
+import cProfile
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+import tracing
+
+# Кропы, future для оценок и список для профиля, если запрос профилируется.
+Item = Tuple[np.ndarray, Future, Optional[List[bytes]]]
+
+
+class MicroBatcher:
+    """Собирает кропы лиц от параллельных запросов в один проход модели.
+
+    Батч уходит в модель, как только набралось ``max_batch_size`` кропов
+    или с первого запроса прошло ``max_wait_ms`` миллисекунд. ``predict``
+    получает список групп кропов (по одной на запрос) и возвращает оценки
+    для всех кропов подряд. Если в батче есть профилируемый запрос, проход
+    модели идёт под cProfile, и профиль получает каждый такой запрос.
+    """
+
+    def __init__(
+        self,
+        predict: Callable[[List[np.ndarray]], np.ndarray],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 2.0,
+    ) -> None:
+        self._predict = predict
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: "queue.Queue[Item]" = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._loop, name="emotion-batcher", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, faces: np.ndarray, profile_sink: Optional[List[bytes]] = None) -> Future:
+        future: Future = Future()
+        self._queue.put((faces, future, profile_sink))
+        return future
+
+    def predict(self, faces: np.ndarray) -> np.ndarray:
+        return self.submit(faces, tracing.profile_sink()).result()
+
+    def _run(self, batch: List[Item]) -> np.ndarray:
+        groups = [faces for faces, _, _ in batch]
+        sinks = [sink for _, _, sink in batch if sink is not None]
+        if not sinks:
+            return self._predict(groups)
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return self._predict(groups)
+        finally:
+            profiler.disable()
+            stats = tracing.profile_stats(profiler)
+            for sink in sinks:
+                sink.append(stats)
+
+    def _collect(self) -> List[Item]:
+        batch = [self._queue.get()]
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._collect()
+            try:
+                scores = self._run(batch)
+            except Exception as exc:
+                for _, future, _ in batch:
+                    future.set_exception(exc)
+                continue
+            offset = 0
+            for faces, future, _ in batch:
+                future.set_result(scores[offset : offset + len(faces)])
+                offset += len(faces)
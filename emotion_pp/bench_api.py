@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный бенчмарк API без TensorFlow.
+
+Сервер поднимается в отдельном процессе с подменённым распознавателем
+(фиксированная задержка или загрузка CPU) и хранилищем мемов на
+синтетическом дереве, поэтому замеряются накладные расходы самого
+сервиса: FastAPI/uvicorn, пул инференса, декодирование, отдача мемов.
+Результаты пишутся в JSON и сравниваются с базовым прогоном.
+"""
+
+from __future__ import annotations
+
+import argparse
+import copy
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import cv2
+import numpy as np
+import requests
+
+logger = logging.getLogger("emotion_api.bench")
+
+SCENARIOS = ("health", "meme", "classify")
+FAKE_MODES = ("sleep", "burn")
+
+
+class FakeRecognizer:
+    """Заглушка EmotionRecognizer: декодирует кадр и «думает» заданное время.
+
+    ``sleep`` отпускает GIL, как нативный инференс TensorFlow; ``burn``
+    держит CPU в Python и показывает худший случай для event loop.
+    """
+
+    def __init__(self, latency_ms: float = 20.0, mode: str = "sleep", decode: bool = True) -> None:
+        from emotion_recognition import DEFAULT_DETECTOR_BACKEND
+
+        if mode not in FAKE_MODES:
+            raise ValueError(f"Unknown fake mode: {mode}")
+        self.latency = latency_ms / 1000.0
+        self.mode = mode
+        self.decode = decode
+        self.detector_backend = DEFAULT_DETECTOR_BACKEND
+        self.load_timings: Dict[str, float] = {}
+
+    def with_detector(self, detector_backend: str) -> "FakeRecognizer":
+        clone = copy.copy(self)
+        clone.detector_backend = detector_backend
+        return clone
+
+    def _work(self) -> None:
+        if self.mode == "burn":
+            deadline = time.perf_counter() + self.latency
+            while time.perf_counter() < deadline:
+                pass
+        elif self.latency > 0:
+            time.sleep(self.latency)
+
+    def analyze(
+        self,
+        image_bytes: bytes,
+        detect_face: bool = True,
+        session_id: str | None = None,
+        timings: Optional[Dict[str, float]] = None,
+    ) -> Dict:
+        from emotion_recognition import _load_image
+
+        if self.decode:
+            _load_image(image_bytes, max_side=1280)
+        self._work()
+        return _fake_result()
+
+    def analyze_faces(self, image_bytes: bytes, **_: object) -> List[Dict]:
+        return [{"box": {"x": 0, "y": 0, "w": 48, "h": 48}, **self.analyze(image_bytes)}]
+
+    def analyze_frames(self, frames: List[np.ndarray], **_: object) -> List[Optional[Dict]]:
+        # Как и настоящий распознаватель, весь батч кадров — один вызов модели.
+        self._work()
+        return [{"box": {"x": 0, "y": 0, "w": 48, "h": 48}, **_fake_result()} for _ in frames]
+
+
+def _fake_result() -> Dict:
+    from emotion_recognition import EMOTIONS
+
+    scores = np.random.default_rng().dirichlet(np.ones(len(EMOTIONS)))
+    emotions = {emotion: float(score) for emotion, score in zip(EMOTIONS, scores)}
+    dominant = max(emotions, key=emotions.get)
+    return {"dominant": dominant, "confidence": emotions[dominant], "emotions": emotions}
+
+
+def build_meme_tree(base_path: Path, per_emotion: int, side: int) -> None:
+    from emotion_recognition import EMOTIONS
+
+    rng = np.random.default_rng(0)
+    for emotion in EMOTIONS:
+        folder = base_path / emotion
+        folder.mkdir(parents=True, exist_ok=True)
+        for index in range(per_emotion):
+            noise = rng.integers(0, 255, (side, side, 3), dtype=np.uint8)
+            cv2.imwrite(str(folder / f"{index:04d}.jpg"), cv2.GaussianBlur(noise, (0, 0), 3))
+
+
+def make_payload(side: int) -> bytes:
+    noise = np.random.default_rng(side).integers(0, 255, (side, side, 3), dtype=np.uint8)
+    return cv2.imencode(".jpg", cv2.GaussianBlur(noise, (0, 0), 2))[1].tobytes()
+
+
+def _serve(port: int, meme_dir: str, latency_ms: float, mode: str, decode: bool, workers: int, queue: int) -> None:
+    # Пул читает настройки при импорте run_api, поэтому окружение задаётся до него.
+    os.environ.update(
+        EMOTION_POOL_MODE="thread",
+        EMOTION_POOL_WORKERS=str(workers),
+        EMOTION_POOL_QUEUE=str(queue),
+        EMOTION_CACHE_MAX_ENTRIES="0",
+    )
+    import uvicorn
+
+    import emotion_recognition
+
+    emotion_recognition._recognizer = FakeRecognizer(latency_ms, mode, decode)
+    import run_api
+    from meme_variants import MemeVariants
+
+    run_api.memes = emotion_recognition.MemeStore(meme_dir)
+    run_api.memes.refresh()
+    run_api.variants = MemeVariants(run_api.memes.base_path)
+    uvicorn.run(run_api.app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(base_url: str, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{base_url}/health/ready", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"API at {base_url} did not become ready in {timeout:.0f}s")
+
+
+def run_load(
+    send: Callable[[requests.Session], requests.Response],
+    concurrency: int,
+    duration: float,
+    warmup: float = 1.0,
+) -> Dict[str, float]:
+    """Закрытый цикл: ``concurrency`` клиентов шлют запросы друг за другом."""
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    lock = threading.Lock()
+    started = time.perf_counter()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    def client() -> None:
+        session = requests.Session()
+        local: List[float] = []
+        local_statuses: Dict[str, int] = {}
+        while True:
+            begin = time.perf_counter()
+            if begin >= stop_at:
+                break
+            try:
+                status = str(send(session).status_code)
+            except requests.RequestException as exc:
+                status = exc.__class__.__name__
+            end = time.perf_counter()
+            if begin < measure_from:
+                continue
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+            if status == "200":
+                local.append((end - begin) * 1000)
+        with lock:
+            latencies.extend(local)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Без успешных запросов задержки не определены: None, а не нули.
+    p50 = p95 = p99 = mean = None
+    if latencies:
+        values = np.asarray(latencies)
+        p50, p95, p99 = (float(value) for value in np.percentile(values, [50, 95, 99]))
+        mean = float(values.mean())
+    return {
+        "concurrency": concurrency,
+        "requests": sum(statuses.values()),
+        "errors": sum(count for status, count in statuses.items() if status != "200"),
+        "statuses": statuses,
+        "throughput_rps": len(latencies) / duration,
+        "mean_ms": mean,
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "p99_ms": p99,
+    }
+
+
+def _senders(base_url: str, scenarios: List[str], sizes: List[int]) -> Dict[str, tuple]:
+    from emotion_recognition import EMOTIONS
+
+    senders: Dict[str, tuple] = {}
+    if "health" in scenarios:
+        senders["health"] = (lambda session: session.get(f"{base_url}/health", timeout=30), 0)
+    if "meme" in scenarios:
+        senders["meme_base64"] = (
+            lambda session: session.get(
+                f"{base_url}/meme/{random.choice(EMOTIONS)}/base64", timeout=30
+            ),
+            0,
+        )
+    if "classify" in scenarios:
+        for side in sizes:
+            payload = make_payload(side)
+            senders[f"classify_{side}px"] = (
+                lambda session, payload=payload: session.post(
+                    f"{base_url}/classify",
+                    params={"use_cache": "false"},
+                    files={"file": ("frame.jpg", payload, "image/jpeg")},
+                    timeout=30,
+                ),
+                len(payload),
+            )
+    return senders
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict:
+    concurrency_levels = [int(value) for value in args.concurrency.split(",")]
+    sizes = [int(value) for value in args.sizes.split(",")]
+    scenarios = [value.strip() for value in args.scenarios.split(",")]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f"Unknown scenarios: {sorted(unknown)}")
+
+    port = args.port or _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory(prefix="emotion-bench-") as tmp:
+        build_meme_tree(Path(tmp), args.memes_per_emotion, args.meme_side)
+        context = multiprocessing.get_context("spawn")
+        server = context.Process(
+            target=_serve,
+            args=(
+                port,
+                tmp,
+                args.latency_ms,
+                args.fake_mode,
+                not args.no_decode,
+                args.pool_workers,
+                max(concurrency_levels),
+            ),
+            daemon=True,
+        )
+        server.start()
+        try:
+            _wait_ready(base_url)
+            results: Dict[str, Dict] = {}
+            for name, (send, payload_bytes) in _senders(base_url, scenarios, sizes).items():
+                for concurrency in concurrency_levels:
+                    key = f"{name}@c{concurrency}"
+                    logger.info("Running %s for %.0fs", key, args.duration)
+                    stats = run_load(send, concurrency, args.duration, args.warmup)
+                    results[key] = {**stats, "payload_bytes": payload_bytes}
+        finally:
+            server.terminate()
+            server.join(timeout=10)
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "fake_mode": args.fake_mode,
+            "latency_ms": args.latency_ms,
+            "decode": not args.no_decode,
+            "pool_workers": args.pool_workers,
+            "duration": args.duration,
+        },
+        "scenarios": results,
+    }
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Сценарии, где p95 вырос или пропускная способность упала сильнее допуска."""
+    regressions = []
+    for name, current in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        if current["p95_ms"] is None or base["p95_ms"] is None:
+            pass
+        elif current["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {current['p95_ms']:.1f}ms > baseline {base['p95_ms']:.1f}ms")
+        if current["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {current['throughput_rps']:.1f}/s < baseline {base['throughput_rps']:.1f}/s"
+            )
+    return regressions
+
+
+def print_table(results: Dict) -> None:
+    print(f"{'scenario':<28}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name, stats in results["scenarios"].items():
+        p50, p95, p99 = (
+            "-" if stats[key] is None else f"{stats[key]:.1f}" for key in ("p50_ms", "p95_ms", "p99_ms")
+        )
+        print(
+            f"{name:<28}{stats['throughput_rps']:>10.1f}{p50:>10}{p95:>10}{p99:>10}{stats['errors']:>8}"
+        )
+
+
+def failed_scenarios(results: Dict) -> List[str]:
+    """Сценарии с ошибками: их цифры нельзя сравнивать и принимать за норму."""
+    return [
+        f"{name}: {stats['errors']}/{stats['requests']} failed {stats['statuses']}"
+        for name, stats in results["scenarios"].items()
+        if stats["errors"]
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark API serving overhead with a fake recognizer")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated client counts")
+    parser.add_argument("--sizes", default="320,1280", help="Comma-separated /classify image sides, px")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--fake-mode", choices=FAKE_MODES, default="sleep")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Fake inference time")
+    parser.add_argument("--no-decode", action="store_true", help="Skip image decoding in the fake")
+    parser.add_argument("--pool-workers", type=int, default=4)
+    parser.add_argument("--memes-per-emotion", type=int, default=20)
+    parser.add_argument("--meme-side", type=int, default=480)
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="Previous results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    Path(args.output).write_text(json.dumps(results, indent=2), encoding="utf-8")
+    print_table(results)
+    print(f"\nSaved to {args.output}")
+
+    failures = failed_scenarios(results)
+    if failures:
+        print("\nScenarios with errors:")
+        for line in failures:
+            print(f"  {line}")
+        sys.exit(1)
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions against baseline")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    main()
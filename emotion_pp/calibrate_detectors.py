@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Калибровка детекторов лиц DeepFace на размеченной папке изображений.
+
+Папка устроена как ``<root>/<emotion>/*.jpg``. Каждый детектор меряется в
+отдельном процессе, чтобы пиковая память не смешивалась между бэкендами:
+задержка детекции на изображение, доля изображений с найденным лицом и
+точность доминирующей эмоции. В конце печатается таблица с отметкой
+Парето-оптимальных бэкендов (задержка p50 против точности).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import multiprocessing
+import resource
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from emotion_recognition import (
+    DETECTOR_BACKENDS,
+    EMOTIONS,
+    EmotionRecognizer,
+    _load_image,
+)
+
+logger = logging.getLogger("emotion_api.calibration")
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+Sample = Tuple[Path, str]
+
+
+def load_samples(root: Path, limit: Optional[int] = None) -> List[Sample]:
+    samples: List[Sample] = []
+    for emotion in EMOTIONS:
+        folder = root / emotion
+        if not folder.is_dir():
+            continue
+        files = sorted(
+            path for path in folder.iterdir() if path.suffix.lower() in IMAGE_SUFFIXES
+        )
+        samples.extend((path, emotion) for path in files[:limit])
+    return samples
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss в Linux в килобайтах.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _calibrate(backend: str, samples: List[Sample], max_side: Optional[int]) -> Dict:
+    started = time.perf_counter()
+    try:
+        recognizer = EmotionRecognizer(detector_backend=backend)
+    except (ImportError, ModuleNotFoundError) as exc:
+        return {"backend": backend, "available": False, "error": str(exc)}
+    load_seconds = time.perf_counter() - started
+    rss_after_load = _peak_rss_mb()
+
+    latencies: List[float] = []
+    found = correct = failed = 0
+    for path, label in samples:
+        try:
+            frame = _load_image(path.read_bytes(), max_side=max_side)
+            timings: Dict[str, float] = {}
+            faces, boxes = recognizer._detect(frame, detect_face=False, timings=timings)
+        except Exception as exc:
+            failed += 1
+            logger.warning("%s failed on %s: %s", backend, path, exc)
+            continue
+        latencies.append(sum(timings.values()) * 1000)
+        if not boxes:
+            continue
+        found += 1
+        scores = recognizer.classify_faces(faces)
+        if EMOTIONS[int(scores[0].argmax())] == label:
+            correct += 1
+
+    total = len(samples)
+    return {
+        "backend": backend,
+        "available": True,
+        "images": total,
+        "failed": failed,
+        "load_s": load_seconds,
+        "p50_ms": _percentile(latencies, 0.5),
+        "p95_ms": _percentile(latencies, 0.95),
+        "mean_ms": statistics.fmean(latencies) if latencies else 0.0,
+        "face_rate": found / total if total else 0.0,
+        # Лицо не найдено — ответ считается неверным: так сравниваются
+        # детекторы, а не только качество классификатора на удачных кропах.
+        "accuracy": correct / total if total else 0.0,
+        "accuracy_on_found": correct / found if found else 0.0,
+        "rss_load_mb": rss_after_load,
+        "rss_peak_mb": _peak_rss_mb(),
+    }
+
+
+def _calibrate_job(backend: str, samples: List[Sample], max_side: Optional[int]) -> Dict:
+    try:
+        return _calibrate(backend, samples, max_side)
+    except Exception as exc:
+        return {"backend": backend, "available": False, "error": str(exc)}
+
+
+def mark_pareto(results: List[Dict]) -> None:
+    measured = [item for item in results if item["available"]]
+    for item in measured:
+        item["pareto"] = not any(
+            other is not item
+            and other["p50_ms"] <= item["p50_ms"]
+            and other["accuracy"] >= item["accuracy"]
+            and (other["p50_ms"] < item["p50_ms"] or other["accuracy"] > item["accuracy"])
+            for other in measured
+        )
+
+
+def calibrate(
+    root: Path,
+    backends: List[str],
+    limit: Optional[int] = None,
+    max_side: Optional[int] = None,
+) -> List[Dict]:
+    samples = load_samples(root, limit)
+    if not samples:
+        raise ValueError(f"No labelled images under {root}")
+    logger.info("Calibrating %d backends on %d images", len(backends), len(samples))
+    # spawn: у каждого бэкенда чистый процесс без уже загруженного TensorFlow.
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for backend in backends:
+        with context.Pool(1) as pool:
+            result = pool.apply(_calibrate_job, (backend, samples, max_side))
+        if result["available"]:
+            logger.info("%s: p50 %.1f ms, accuracy %.3f", backend, result["p50_ms"], result["accuracy"])
+        else:
+            logger.info("%s unavailable: %s", backend, result["error"])
+        results.append(result)
+    mark_pareto(results)
+    return results
+
+
+def print_table(results: List[Dict]) -> None:
+    print(
+        f"{'backend':<12}{'p50 ms':>9}{'p95 ms':>9}{'faces':>8}{'acc':>8}"
+        f"{'acc@face':>10}{'rss MB':>9}{'load s':>8}  pareto"
+    )
+    measured = sorted(
+        (item for item in results if item["available"]), key=lambda item: item["p50_ms"]
+    )
+    for item in measured:
+        print(
+            f"{item['backend']:<12}{item['p50_ms']:>9.1f}{item['p95_ms']:>9.1f}"
+            f"{item['face_rate']:>8.1%}{item['accuracy']:>8.1%}{item['accuracy_on_found']:>10.1%}"
+            f"{item['rss_peak_mb']:>9.0f}{item['load_s']:>8.1f}  {'*' if item['pareto'] else ''}"
+        )
+    for item in results:
+        if not item["available"]:
+            print(f"{item['backend']:<12}unavailable: {item['error']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare DeepFace detector backends")
+    parser.add_argument("root", help="Folder with <emotion>/<image> layout")
+    parser.add_argument("--backends", default=",".join(DETECTOR_BACKENDS))
+    parser.add_argument("--limit", type=int, default=None, help="Images per emotion")
+    parser.add_argument("--max-side", type=int, default=None, help="Downscale images before detection")
+    parser.add_argument("--output", help="Write results JSON here")
+    args = parser.parse_args()
+    backends = [name.strip() for name in args.backends.split(",") if name.strip()]
+    unknown = sorted(set(backends) - set(DETECTOR_BACKENDS))
+    if unknown:
+        parser.error(f"Unknown backends: {', '.join(unknown)}")
+    results = calibrate(Path(args.root), backends, args.limit, args.max_side)
+    print_table(results)
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+    sys.exit(0 if any(item["available"] for item in results) else 1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    main()
@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+Пакетная разметка эмоций по папкам или списку файлов без HTTP API.
+
+Файлы идут в пул процессов, в каждом из которых один прогретый
+``EmotionRecognizer``; в полёте не больше ``--window`` файлов, а
+результаты сразу дописываются в JSONL/CSV/Parquet, поэтому память не
+зависит от размера архива. Рядом с результатом ведётся чекпоинт в SQLite:
+при повторном запуске пропускаются уже обработанные файлы (по пути, размеру
+и mtime), а файл с содержимым уже сохранённого оригинала (по sha256) в
+модель не идёт и записывается с ``duplicate_of``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from emotion_recognition import EMOTIONS
+from prefork import thread_env
+
+logger = logging.getLogger("emotion_api.bulk")
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp"}
+OUTPUT_FORMATS = ("jsonl", "csv", "parquet")
+FLAT_FIELDS = ["path", "sha256", "dominant_emotion", "confidence", *EMOTIONS, "duplicate_of", "error"]
+
+Record = Dict[str, object]
+FileKey = Tuple[str, int, int]
+
+CHECKPOINT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed (
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    duplicate_of TEXT,
+    PRIMARY KEY (path, size, mtime_ns)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS processed_sha256 ON processed (sha256);
+"""
+
+_worker_state: Dict[str, object] = {}
+
+
+def _init_worker(threads: int, detect_face: bool, detector_backend: Optional[str]) -> None:
+    # Лимиты потоков задаются до первого импорта TensorFlow в процессе.
+    os.environ.update(thread_env(threads))
+    from emotion_recognition import get_recognizer
+
+    _worker_state["recognizer"] = get_recognizer(detector_backend)
+    _worker_state["detect_face"] = detect_face
+
+
+def _classify_payload(path: str, sha256: str, payload: bytes) -> Record:
+    started = time.perf_counter()
+    record: Record = {"path": path, "sha256": sha256}
+    try:
+        result = _worker_state["recognizer"].analyze(
+            payload, detect_face=_worker_state["detect_face"]
+        )
+        record.update(
+            dominant_emotion=result["dominant"],
+            confidence=result["confidence"],
+            emotions=result["emotions"],
+        )
+    except Exception as exc:
+        record["error"] = f"{exc.__class__.__name__}: {exc}"
+    record["elapsed_ms"] = (time.perf_counter() - started) * 1000
+    return record
+
+
+def iter_images(roots: Iterable[str], files_from: Optional[str] = None) -> Iterator[Path]:
+    """Лениво перечисляет изображения, не собирая список в память."""
+    if files_from:
+        handle = sys.stdin if files_from == "-" else open(files_from, encoding="utf-8")
+        with handle:
+            for line in handle:
+                line = line.strip()
+                if line:
+                    yield Path(line)
+    for root in roots:
+        root_path = Path(root)
+        if root_path.is_file():
+            yield root_path
+            continue
+        for folder, dirs, files in os.walk(root_path):
+            dirs.sort()
+            for name in sorted(files):
+                if Path(name).suffix.lower() in IMAGE_SUFFIXES:
+                    yield Path(folder) / name
+
+
+def _file_key(path: Path) -> Optional[FileKey]:
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return str(path), stat.st_size, stat.st_mtime_ns
+
+
+class Checkpoint:
+    """Сохранённые результаты в SQLite: память не растёт с числом файлов."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._conn = sqlite3.connect(path, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(CHECKPOINT_SCHEMA)
+
+    def done(self, key: FileKey) -> bool:
+        row = self._conn.execute(
+            "SELECT 1 FROM processed WHERE path = ? AND size = ? AND mtime_ns = ?", key
+        ).fetchone()
+        return row is not None
+
+    def original(self, sha256: str) -> Optional[str]:
+        """Путь уже сохранённого оригинала с таким содержимым."""
+        row = self._conn.execute(
+            "SELECT path FROM processed WHERE sha256 = ? AND duplicate_of IS NULL LIMIT 1",
+            (sha256,),
+        ).fetchone()
+        return row[0] if row else None
+
+    def add(self, records: List[Record]) -> None:
+        if not records:
+            return
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO processed (path, size, mtime_ns, sha256, duplicate_of) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(*record["_key"], record["sha256"], record.get("duplicate_of")) for record in records],
+            )
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def _flatten(record: Record) -> Record:
+    flat = {name: record.get(name) for name in FLAT_FIELDS}
+    flat.update(record.get("emotions") or {})
+    return flat
+
+
+class JsonlSink:
+    def __init__(self, path: Path) -> None:
+        self._handle = path.open("a", encoding="utf-8")
+        self._pending: List[Record] = []
+
+    def add(self, record: Record) -> None:
+        public = {key: value for key, value in record.items() if not key.startswith("_")}
+        self._handle.write(json.dumps(public, ensure_ascii=False) + "\n")
+        self._pending.append(record)
+
+    def commit(self, final: bool = False) -> List[Record]:
+        self._handle.flush()
+        committed, self._pending = self._pending, []
+        return committed
+
+    def close(self) -> None:
+        self._handle.close()
+
+
+class CsvSink(JsonlSink):
+    def __init__(self, path: Path) -> None:
+        fresh = not path.exists() or path.stat().st_size == 0
+        self._handle = path.open("a", encoding="utf-8", newline="")
+        self._writer = csv.DictWriter(self._handle, fieldnames=FLAT_FIELDS)
+        if fresh:
+            self._writer.writeheader()
+        self._pending = []
+
+    def add(self, record: Record) -> None:
+        self._writer.writerow(_flatten(record))
+        self._pending.append(record)
+
+
+class ParquetSink:
+    """Каталог part-файлов: файл закрывается целиком, а уже потом попадает в чекпоинт.
+
+    Незакрытый Parquet без футера нечитаем, поэтому строки копятся до
+    ``part_rows`` и пишутся отдельным файлом.
+    """
+
+    def __init__(self, path: Path, part_rows: int = 10000) -> None:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as exc:
+            raise ImportError("Parquet output needs pyarrow: pip install pyarrow") from exc
+        self._pa, self._pq = pa, pq
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.part_rows = part_rows
+        self._pending: List[Record] = []
+        self._run = time.strftime("%Y%m%d-%H%M%S")
+        self._parts = 0
+
+    def add(self, record: Record) -> None:
+        self._pending.append(record)
+
+    def commit(self, final: bool = False) -> List[Record]:
+        if not self._pending or (len(self._pending) < self.part_rows and not final):
+            return []
+        rows = [_flatten(record) for record in self._pending]
+        table = self._pa.Table.from_pylist(rows, schema=self._schema())
+        target = self.path / f"part-{self._run}-{self._parts:05d}.parquet"
+        tmp = target.with_suffix(".tmp")
+        self._pq.write_table(table, tmp)
+        os.replace(tmp, target)
+        self._parts += 1
+        committed, self._pending = self._pending, []
+        return committed
+
+    def _schema(self):
+        # Явная схема: иначе колонка из одних None в части получит тип null.
+        pa = self._pa
+        numeric = {"confidence", *EMOTIONS}
+        return pa.schema(
+            [(name, pa.float64() if name in numeric else pa.string()) for name in FLAT_FIELDS]
+        )
+
+    def close(self) -> None:
+        pass
+
+
+SINKS = {"jsonl": JsonlSink, "csv": CsvSink, "parquet": ParquetSink}
+
+
+class Progress:
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.started = self._last_report = time.perf_counter()
+        self.counts = {"done": 0, "errors": 0, "skipped": 0, "duplicates": 0}
+        self._last_done = 0
+
+    def maybe_report(self, in_flight: int, force: bool = False) -> None:
+        now = time.perf_counter()
+        if not force and now - self._last_report < self.interval:
+            return
+        done = self.counts["done"]
+        recent = (done - self._last_done) / max(now - self._last_report, 1e-9)
+        overall = done / max(now - self.started, 1e-9)
+        logger.info(
+            "%s, in flight %d, %.1f files/s now, %.1f files/s overall",
+            ", ".join(f"{name} {value}" for name, value in self.counts.items()),
+            in_flight,
+            recent,
+            overall,
+        )
+        self._last_report, self._last_done = now, done
+
+
+def classify_tree(
+    roots: List[str],
+    output: Path,
+    fmt: str,
+    files_from: Optional[str] = None,
+    workers: int = 1,
+    threads: int = 1,
+    window: Optional[int] = None,
+    detect_face: bool = True,
+    detector_backend: Optional[str] = None,
+    checkpoint_path: Optional[Path] = None,
+    progress_interval: float = 10.0,
+    part_rows: int = 10000,
+) -> Dict[str, int]:
+    checkpoint = Checkpoint(checkpoint_path or output.with_name(output.name + ".checkpoint.sqlite3"))
+    sink = ParquetSink(output, part_rows) if fmt == "parquet" else SINKS[fmt](output)
+    progress = Progress(progress_interval)
+    window = window or workers * 4
+    # spawn: TensorFlow не переживает fork, а воркеры грузят модель сами.
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(threads, detect_face, detector_backend),
+    )
+    pending: Dict[Future, FileKey] = {}
+
+    def handle(done: Iterable[Future]) -> None:
+        for future in done:
+            key = pending.pop(future)
+            record = future.result()
+            if "error" in record:
+                # Ошибки не попадают в чекпоинт и повторяются при следующем запуске.
+                progress.counts["errors"] += 1
+                logger.warning("%s: %s", record["path"], record["error"])
+                continue
+            record["_key"] = key
+            progress.counts["done"] += 1
+            sink.add(record)
+        checkpoint.add(sink.commit())
+
+    try:
+        for path in iter_images(roots, files_from):
+            key = _file_key(path)
+            if key is None or checkpoint.done(key):
+                progress.counts["skipped"] += 1
+                continue
+            try:
+                payload = path.read_bytes()
+            except OSError as exc:
+                progress.counts["errors"] += 1
+                logger.warning("%s: %s", path, exc)
+                continue
+            sha256 = hashlib.sha256(payload).hexdigest()
+            # Только сохранённый оригинал: файл в полёте ещё может упасть с ошибкой,
+            # поэтому копии незавершённого оригинала размечаются сами.
+            original = checkpoint.original(sha256)
+            if original is not None and original != str(path):
+                progress.counts["duplicates"] += 1
+                sink.add({"path": str(path), "sha256": sha256, "duplicate_of": original, "_key": key})
+                checkpoint.add(sink.commit())
+                continue
+            pending[executor.submit(_classify_payload, str(path), sha256, payload)] = key
+            if len(pending) >= window:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                handle(done)
+                progress.maybe_report(len(pending))
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            handle(done)
+            progress.maybe_report(len(pending))
+    finally:
+        checkpoint.add(sink.commit(final=True))
+        sink.close()
+        checkpoint.close()
+        executor.shutdown(wait=True, cancel_futures=True)
+    progress.maybe_report(0, force=True)
+    return dict(progress.counts)
+
+
+def _output_format(output: str, fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    suffix = Path(output).suffix.lower().lstrip(".")
+    return suffix if suffix in OUTPUT_FORMATS else "jsonl"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Classify emotions for every image in a tree")
+    parser.add_argument("roots", nargs="*", help="Directories or image files")
+    parser.add_argument("--files-from", help="File with one image path per line, '-' for stdin")
+    parser.add_argument("--output", required=True, help="Results file (a directory for parquet)")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, help="Default: from the output suffix")
+    parser.add_argument("--checkpoint", help="Default: <output>.checkpoint.sqlite3")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads", type=int, default=1, help="Inference threads per worker")
+    parser.add_argument("--window", type=int, default=None, help="Max files in flight, default 4 per worker")
+    parser.add_argument("--no-detect-face", action="store_true", help="Classify whole images")
+    parser.add_argument("--detector-backend", default=None)
+    parser.add_argument("--progress", type=float, default=10.0, help="Seconds between stats lines")
+    parser.add_argument("--parquet-rows", type=int, default=10000, help="Rows per parquet part file")
+    args = parser.parse_args()
+    if not args.roots and not args.files_from:
+        parser.error("Give at least one directory or --files-from")
+    stats = classify_tree(
+        args.roots,
+        Path(args.output),
+        _output_format(args.output, args.format),
+        files_from=args.files_from,
+        workers=max(1, args.workers),
+        threads=max(1, args.threads),
+        window=args.window,
+        detect_face=not args.no_detect_face,
+        detector_backend=args.detector_backend,
+        checkpoint_path=Path(args.checkpoint) if args.checkpoint else None,
+        progress_interval=args.progress,
+        part_rows=args.parquet_rows,
+    )
+    print(stats)
+    sys.exit(1 if stats["errors"] else 0)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    main()
@@ -0,0 +1,208 @@
+"""
+Прямой инференс модели эмоций из facial_expression_model_weights.h5.
+
+Модель собирается один раз, вызывается как tf.function с единственной
+сигнатурой и получает кропы 48x48 через заранее выделенный буфер.
+Модели, экспортированные ``export_model.py`` в ONNX и TFLite, исполняются
+onnxruntime и интерпретатором TFLite с тем же интерфейсом.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from pathlib import Path
+from typing import Sequence, Union
+
+import numpy as np
+
+INPUT_SHAPE = (48, 48, 1)
+NUM_CLASSES = 7
+EXPORTED_FORMATS = {"onnx": ".onnx", "tflite": ".tflite"}
+
+
+def exported_model_path(weights_dir: Path, fmt: str, int8: bool = False) -> Path:
+    suffix = ".int8" if int8 else ""
+    return weights_dir / f"facial_expression_model{suffix}{EXPORTED_FORMATS[fmt]}"
+
+
+def _inference_threads() -> int:
+    # 0 — решение остаётся за рантаймом.
+    return int(os.getenv("EMOTION_INFERENCE_THREADS", "0"))
+
+
+def build_keras_model(weights_path: Path):
+    from tensorflow.keras.layers import (
+        AveragePooling2D,
+        Conv2D,
+        Dense,
+        Dropout,
+        Flatten,
+        MaxPooling2D,
+    )
+    from tensorflow.keras.models import Sequential
+
+    # Та же архитектура, что у DeepFace, чтобы веса загружались как есть.
+    model = Sequential(
+        [
+            Conv2D(64, (5, 5), activation="relu", input_shape=INPUT_SHAPE),
+            MaxPooling2D(pool_size=(5, 5), strides=(2, 2)),
+            Conv2D(64, (3, 3), activation="relu"),
+            Conv2D(64, (3, 3), activation="relu"),
+            AveragePooling2D(pool_size=(3, 3), strides=(2, 2)),
+            Conv2D(128, (3, 3), activation="relu"),
+            Conv2D(128, (3, 3), activation="relu"),
+            AveragePooling2D(pool_size=(3, 3), strides=(2, 2)),
+            Flatten(),
+            Dense(1024, activation="relu"),
+            Dropout(0.2),
+            Dense(1024, activation="relu"),
+            Dropout(0.2),
+            Dense(NUM_CLASSES, activation="softmax"),
+        ]
+    )
+    model.load_weights(str(weights_path))
+    return model
+
+
+class EmotionModel:
+    def __init__(self, weights_path: Path, max_batch_size: int = 16) -> None:
+        import tensorflow as tf
+
+        self.model = build_keras_model(weights_path)
+        self._infer = tf.function(
+            lambda batch: self.model(batch, training=False),
+            input_signature=[tf.TensorSpec([None, *INPUT_SHAPE], tf.float32)],
+        )
+        self._buffer = np.zeros((max(1, max_batch_size), *INPUT_SHAPE), dtype=np.float32)
+        self._lock = threading.Lock()
+
+    def predict_groups(self, groups: Sequence[np.ndarray]) -> np.ndarray:
+        total = sum(len(group) for group in groups)
+        with self._lock:
+            if total > len(self._buffer):
+                self._buffer = np.zeros((total, *INPUT_SHAPE), dtype=np.float32)
+            offset = 0
+            for group in groups:
+                self._buffer[offset : offset + len(group)] = group
+                offset += len(group)
+            return self._infer(self._buffer[:total]).numpy()
+
+    def predict(self, faces: np.ndarray) -> np.ndarray:
+        return self.predict_groups([faces])
+
+    def warmup(self) -> None:
+        """Трассирует граф и выделяет память до первого реального запроса."""
+        self.predict(np.zeros((1, *INPUT_SHAPE), dtype=np.float32))
+        self.predict(np.zeros((len(self._buffer), *INPUT_SHAPE), dtype=np.float32))
+
+
+class OnnxEmotionModel:
+    def __init__(self, model_path: Path, max_batch_size: int = 16) -> None:
+        try:
+            import onnxruntime as ort
+        except ImportError as exc:
+            raise ImportError(
+                "ONNX inference needs onnxruntime: pip install onnxruntime"
+            ) from exc
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        threads = _inference_threads()
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self._session = ort.InferenceSession(
+            str(model_path), options, providers=["CPUExecutionProvider"]
+        )
+        self._input = self._session.get_inputs()[0].name
+        self.max_batch_size = max(1, max_batch_size)
+
+    def predict_groups(self, groups: Sequence[np.ndarray]) -> np.ndarray:
+        return self.predict(np.concatenate(groups))
+
+    def predict(self, faces: np.ndarray) -> np.ndarray:
+        # InferenceSession.run потокобезопасен, блокировка не нужна.
+        batch = np.ascontiguousarray(faces, dtype=np.float32)
+        return self._session.run(None, {self._input: batch})[0]
+
+    def warmup(self) -> None:
+        self.predict(np.zeros((1, *INPUT_SHAPE), dtype=np.float32))
+        self.predict(np.zeros((self.max_batch_size, *INPUT_SHAPE), dtype=np.float32))
+
+
+def _tflite_interpreter(model_path: Path, threads: int):
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        try:
+            import tensorflow as tf
+        except ImportError as exc:
+            raise ImportError(
+                "TFLite inference needs tflite-runtime or tensorflow: pip install tflite-runtime"
+            ) from exc
+        Interpreter = tf.lite.Interpreter
+    return Interpreter(model_path=str(model_path), num_threads=threads or None)
+
+
+class TFLiteEmotionModel:
+    def __init__(self, model_path: Path, max_batch_size: int = 16) -> None:
+        self._interpreter = _tflite_interpreter(model_path, _inference_threads())
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch = 0
+        self.max_batch_size = max(1, max_batch_size)
+        self._lock = threading.Lock()
+
+    def _resize(self, batch: int) -> None:
+        # Перераспределение тензоров дорогое, поэтому только при смене размера батча.
+        if batch != self._batch:
+            self._interpreter.resize_tensor_input(self._input["index"], [batch, *INPUT_SHAPE])
+            self._interpreter.allocate_tensors()
+            self._input = self._interpreter.get_input_details()[0]
+            self._output = self._interpreter.get_output_details()[0]
+            self._batch = batch
+
+    def predict_groups(self, groups: Sequence[np.ndarray]) -> np.ndarray:
+        return self.predict(np.concatenate(groups))
+
+    def predict(self, faces: np.ndarray) -> np.ndarray:
+        batch = np.asarray(faces, dtype=np.float32)
+        with self._lock:
+            self._resize(len(batch))
+            self._interpreter.set_tensor(self._input["index"], _quantize(batch, self._input))
+            self._interpreter.invoke()
+            return _dequantize(self._interpreter.get_tensor(self._output["index"]), self._output)
+
+    def warmup(self) -> None:
+        self.predict(np.zeros((1, *INPUT_SHAPE), dtype=np.float32))
+
+
+def _quantize(values: np.ndarray, detail: dict) -> np.ndarray:
+    scale, zero_point = detail["quantization"]
+    if detail["dtype"] == np.float32 or not scale:
+        return values.astype(detail["dtype"])
+    info = np.iinfo(detail["dtype"])
+    return np.clip(np.round(values / scale + zero_point), info.min, info.max).astype(detail["dtype"])
+
+
+def _dequantize(values: np.ndarray, detail: dict) -> np.ndarray:
+    scale, zero_point = detail["quantization"]
+    if detail["dtype"] == np.float32 or not scale:
+        return values.astype(np.float32)
+    return (values.astype(np.float32) - zero_point) * scale
+
+
+ExportedModel = Union[OnnxEmotionModel, TFLiteEmotionModel]
+
+
+def load_exported_model(fmt: str, model_path: Path, max_batch_size: int = 16) -> ExportedModel:
+    if not model_path.exists():
+        raise FileNotFoundError(
+            f"{model_path} not found, export it with: python export_model.py export --format {fmt}"
+        )
+    if fmt == "onnx":
+        return OnnxEmotionModel(model_path, max_batch_size)
+    if fmt == "tflite":
+        return TFLiteEmotionModel(model_path, max_batch_size)
+    raise ValueError(f"Unknown exported model format: {fmt}")
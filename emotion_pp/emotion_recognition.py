@@ -1,17 +1,32 @@
 from __future__ import annotations
 
+import copy
+import hashlib
+import logging
+import os
 import random
-from dataclasses import dataclass
+import threading
+import time
+import warnings
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from io import BytesIO
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
 
 import cv2
 import numpy as np
-from PIL import Image
-import requests
-import tensorflow as tf  # noqa: F401 (ensures tensorflow.keras is registered)
-from deepface import DeepFace
+from PIL import Image, ImageOps
+
+import tracing
+from batching import MicroBatcher
+from emotion_model import EXPORTED_FORMATS, exported_model_path
+from face_tracking import Box, FaceTracker
+from near_duplicates import NearDuplicateIndex, dhash
+from video_timeline import Sampling, VideoFrames, batched, timeline_entry
+from weight_store import WeightSpec, WeightStore
+
+logger = logging.getLogger("emotion_api.recognition")
 
 EMOTIONS: List[str] = [
     "angry",
@@ -23,76 +38,529 @@ EMOTIONS: List[str] = [
     "neutral",
 ]
 
+FACE_SIZE = (48, 48)
+INFERENCE_MODES = ("direct", "deepface", *EXPORTED_FORMATS)
+DETECTOR_BACKENDS = (
+    "opencv",
+    "ssd",
+    "mtcnn",
+    "retinaface",
+    "yunet",
+    "mediapipe",
+    "dlib",
+    "yolov8",
+    "centerface",
+)
+DEFAULT_DETECTOR_BACKEND = os.getenv("EMOTION_DETECTOR_BACKEND", "opencv")
+MODEL_VERSION = "facial_expression_model_weights-v1.0"
+
+
+REDUCED_FLAGS = {
+    (1, False): cv2.IMREAD_COLOR,
+    (2, False): cv2.IMREAD_REDUCED_COLOR_2,
+    (4, False): cv2.IMREAD_REDUCED_COLOR_4,
+    (8, False): cv2.IMREAD_REDUCED_COLOR_8,
+    (1, True): cv2.IMREAD_GRAYSCALE,
+    (2, True): cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    (4, True): cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    (8, True): cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+class ImageTooLarge(ValueError):
+    """Изображение превышает допустимый бюджет пикселей."""
+
+
+Timings = Optional[Dict[str, float]]
+
+
+@contextmanager
+def _stage(timings: Timings, name: str) -> Iterator[None]:
+    """Спан трассировки и длительность блока в ``timings[name]``, если словарь передан."""
+    with tracing.span(name):
+        if timings is None:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - started
+
 
-def _load_image(image_bytes: bytes) -> np.ndarray:
+# Значения EXIF Orientation, при которых кадр повёрнут на 90°.
+EXIF_ORIENTATION = 0x0112
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+def _image_size(image_bytes: bytes) -> Optional[Tuple[int, int]]:
+    """Размеры из заголовка, без декодирования пикселей.
+
+    С учётом EXIF Orientation, как и у декодированного кадра: OpenCV
+    поворачивает его при imdecode.
+    """
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            with Image.open(BytesIO(image_bytes)) as image:
+                width, height = image.size
+                if image.getexif().get(EXIF_ORIENTATION) in TRANSPOSED_ORIENTATIONS:
+                    return height, width
+                return width, height
+    except Image.DecompressionBombError as exc:
+        raise ImageTooLarge(str(exc))
+    except Exception:
+        return None
+
+
+def _decode_with_pil(image_bytes: bytes, grayscale: bool) -> Optional[np.ndarray]:
+    try:
+        with Image.open(BytesIO(image_bytes)) as image:
+            image = ImageOps.exif_transpose(image)
+            if grayscale:
+                return np.asarray(image.convert("L"))
+            return cv2.cvtColor(np.asarray(image.convert("RGB")), cv2.COLOR_RGB2BGR)
+    except Exception:
+        return None
+
+
+def _load_image(
+    image_bytes: bytes,
+    max_pixels: int | None = None,
+    max_side: int | None = None,
+    grayscale: bool = False,
+) -> np.ndarray:
     if not image_bytes:
         raise ValueError("Empty payload")
+    size = _image_size(image_bytes)
+    if size and max_pixels and size[0] * size[1] > max_pixels:
+        raise ImageTooLarge(
+            f"Image is {size[0]}x{size[1]}, over the {max_pixels} pixel budget"
+        )
+    # Для JPEG libjpeg масштабирует прямо при декодировании (1/2, 1/4, 1/8).
+    factor = 1
+    if size and max_side:
+        while factor < 8 and max(size) / (factor * 2) >= max_side:
+            factor *= 2
     array = np.frombuffer(image_bytes, np.uint8)
-    frame = cv2.imdecode(array, cv2.IMREAD_COLOR)
+    frame = cv2.imdecode(array, REDUCED_FLAGS[(factor, grayscale)])
+    if frame is None:
+        # GIF и прочие форматы, которые OpenCV не декодирует.
+        frame = _decode_with_pil(image_bytes, grayscale)
     if frame is None:
         raise ValueError("Cannot decode image")
+    if max_side and max(frame.shape[:2]) > max_side:
+        scale = max_side / max(frame.shape[:2])
+        frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    if grayscale:
+        # Детекторы DeepFace ждут трёхканальный BGR.
+        frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
     return frame
 
 
+def _normalize_emotion_matrix(scores: np.ndarray) -> np.ndarray:
+    values = np.asarray(scores, dtype=np.float64)
+    values = np.clip(np.where(values > 1, values / 100.0, values), 0.0, 1.0)
+    totals = values.sum(axis=1, keepdims=True)
+    uniform = np.full_like(values, 1.0 / max(values.shape[1], 1))
+    return np.divide(values, totals, out=uniform, where=totals > 0)
+
+
 def _normalize_emotions(emotions: Dict[str, float]) -> Dict[str, float]:
-    cleaned: Dict[str, float] = {}
-    for emotion, score in emotions.items():
-        value = float(score)
-        if value > 1:
-            value /= 100.0
-        cleaned[emotion] = max(0.0, min(1.0, value))
-    total = sum(cleaned.values())
-    if total > 0:
-        return {emotion: value / total for emotion, value in cleaned.items()}
+    if emotions:
+        row = _normalize_emotion_matrix([list(emotions.values())])[0]
+        if row.sum() > 0:
+            return {emotion: float(value) for emotion, value in zip(emotions, row)}
     return {emotion: (1.0 / len(EMOTIONS)) for emotion in EMOTIONS}
 
 
+def _prepare_face(face: np.ndarray) -> np.ndarray:
+    crop = np.asarray(face, dtype=np.float32)
+    if crop.ndim == 4:
+        crop = crop[0]
+    if crop.max(initial=0.0) > 1.0:
+        crop = crop / 255.0
+    if crop.ndim == 3:
+        crop = cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY)
+    return cv2.resize(crop, FACE_SIZE)[..., np.newaxis]
+
+
+def _summarize(scores: np.ndarray) -> Dict[str, float]:
+    normalized = dict(zip(EMOTIONS, scores.tolist()))
+    dominant = max(normalized, key=normalized.get)
+    return {
+        "dominant": dominant,
+        "confidence": normalized[dominant],
+        "emotions": normalized,
+    }
+
+
+def _face_box(record: Dict) -> Optional[Box]:
+    area = record.get("facial_area") or {}
+    # confidence == 0: лицо не найдено, DeepFace вернул весь кадр.
+    if record.get("confidence") == 0 or not area.get("w") or not area.get("h"):
+        return None
+    return int(area["x"]), int(area["y"]), int(area["w"]), int(area["h"])
+
+
+def _weights_dir() -> Path:
+    return Path.home() / ".deepface" / "weights"
+
+
+def model_version() -> str:
+    """Версия модели для ключа кэша: экспорт (особенно int8) отвечает чуть иначе."""
+    mode = os.getenv("EMOTION_INFERENCE_MODE", "direct").lower()
+    if mode not in EXPORTED_FORMATS:
+        return MODEL_VERSION
+    path = os.getenv("EMOTION_MODEL_PATH") or exported_model_path(_weights_dir(), mode)
+    return f"{MODEL_VERSION}+{Path(path).name}"
+
+
+def _build_emotion_classifier(deepface):
+    try:
+        client = deepface.build_model("Emotion", task="facial_attribute")
+    except TypeError:
+        client = deepface.build_model("Emotion")
+    return getattr(client, "model", client)
+
+
 @dataclass
 class EmotionRecognizer:
-    detector_backend: str = "opencv"
-    _weights: List[tuple[str, str]] = (
-        (
+    detector_backend: str = DEFAULT_DETECTOR_BACKEND
+    max_batch_size: int = field(
+        default_factory=lambda: int(os.getenv("EMOTION_BATCH_SIZE", "16"))
+    )
+    max_batch_wait_ms: float = field(
+        default_factory=lambda: float(os.getenv("EMOTION_BATCH_WAIT_MS", "2"))
+    )
+    near_duplicates: Optional[NearDuplicateIndex] = field(
+        default_factory=NearDuplicateIndex.from_env
+    )
+    inference_mode: str = field(
+        default_factory=lambda: os.getenv("EMOTION_INFERENCE_MODE", "direct").lower()
+    )
+    model_path: Optional[str] = field(
+        default_factory=lambda: os.getenv("EMOTION_MODEL_PATH")
+    )
+    max_pixels: int = field(
+        default_factory=lambda: int(os.getenv("EMOTION_MAX_PIXELS", "50000000"))
+    )
+    detect_max_side: int = field(
+        default_factory=lambda: int(os.getenv("EMOTION_DETECT_MAX_SIDE", "1280"))
+    )
+    decode_grayscale: bool = field(
+        default_factory=lambda: os.getenv("EMOTION_DECODE_GRAYSCALE", "0") == "1"
+    )
+    tracker: Optional[FaceTracker] = field(default_factory=FaceTracker.from_env)
+    max_faces: int = field(
+        default_factory=lambda: int(os.getenv("EMOTION_MAX_FACES", "20"))
+    )
+    min_face_size: int = field(
+        default_factory=lambda: int(os.getenv("EMOTION_MIN_FACE_SIZE", "24"))
+    )
+    # Upstream не публикует sha256 этого файла: закрепите его через
+    # EMOTION_WEIGHTS_SHA256 или .sha256 на зеркале, иначе .h5 проверяется
+    # только на целостность суперблока.
+    _weights: Tuple[WeightSpec, ...] = (
+        WeightSpec(
             "facial_expression_model_weights.h5",
             "https://github.com/serengil/deepface_models/releases/download/v1.0/facial_expression_model_weights.h5",
         ),
     )
 
     def __post_init__(self) -> None:
-        self._ensure_weights()
+        # Тяжёлые импорты откладываются до построения модели, чтобы API
+        # мог подняться и отвечать на /health/live до её загрузки.
+        if self.inference_mode not in INFERENCE_MODES:
+            raise ValueError(f"Unknown inference mode: {self.inference_mode}")
+        self.load_timings: Dict[str, float] = {}
+        exported = self.inference_mode in EXPORTED_FORMATS
+        # Веса проверяются до тяжёлых импортов: без них запуск падает сразу.
+        if not exported:
+            with self._timed("weights"):
+                self._ensure_weights()
+        with self._timed("import_tensorflow"):
+            import tensorflow as tf  # noqa: F401 (ensures tensorflow.keras is registered)
+        with self._timed("import_deepface"):
+            from deepface import DeepFace
         self._model = DeepFace
+        with self._timed("build_classifier"):
+            if self.inference_mode == "direct":
+                from emotion_model import EmotionModel
+
+                self._classifier = EmotionModel(
+                    _weights_dir() / self._weights[0].filename, self.max_batch_size
+                )
+            elif exported:
+                from emotion_model import load_exported_model
+
+                path = Path(self.model_path) if self.model_path else exported_model_path(
+                    _weights_dir(), self.inference_mode
+                )
+                self._classifier = load_exported_model(
+                    self.inference_mode, path, self.max_batch_size
+                )
+            else:
+                self._classifier = _build_emotion_classifier(DeepFace)
+        self._batcher = MicroBatcher(
+            self._predict, self.max_batch_size, self.max_batch_wait_ms
+        )
+        with self._timed("warmup"):
+            self.warmup()
+
+    @contextmanager
+    def _timed(self, phase: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.load_timings[phase] = time.perf_counter() - started
+
+    def with_detector(self, detector_backend: str) -> "EmotionRecognizer":
+        """Копия с другим детектором лиц; классификатор и батчер общие."""
+        clone = copy.copy(self)
+        clone.detector_backend = detector_backend
+        clone.extract_faces(np.zeros((*FACE_SIZE, 3), dtype=np.uint8), detect_face=False)
+        return clone
 
     def _ensure_weights(self) -> None:
-        weights_dir = Path.home() / ".deepface" / "weights"
-        weights_dir.mkdir(parents=True, exist_ok=True)
-        for filename, url in self._weights:
-            target = weights_dir / filename
-            if target.exists():
+        store = WeightStore.from_env(_weights_dir())
+        for spec in self._weights:
+            store.ensure(spec)
+
+    def _predict(self, groups: List[np.ndarray]) -> np.ndarray:
+        if self.inference_mode != "deepface":
+            return self._classifier.predict_groups(groups)
+        return np.asarray(self._classifier.predict_on_batch(np.concatenate(groups)))
+
+    def warmup(self) -> None:
+        blank = np.zeros((*FACE_SIZE, 3), dtype=np.uint8)
+        self.extract_faces(blank, detect_face=False)
+        if self.inference_mode != "deepface":
+            self._classifier.warmup()
+        else:
+            self._predict([np.zeros((1, *FACE_SIZE, 1), dtype=np.float32)])
+
+    def _detect(
+        self, frame: np.ndarray, detect_face: bool, timings: Timings = None
+    ) -> Tuple[np.ndarray, List[Box]]:
+        with _stage(timings, "detect"):
+            records = self._model.extract_faces(
+                img_path=frame,
+                detector_backend=self.detector_backend,
+                enforce_detection=detect_face,
+                align=True,
+            )[:1]
+        if not records:
+            return np.empty((0, *FACE_SIZE, 1), dtype=np.float32), []
+        boxes = [box for box in map(_face_box, records) if box is not None]
+        with _stage(timings, "align"):
+            faces = np.stack([_prepare_face(record["face"]) for record in records])
+        return faces, boxes
+
+    def _detect_all(
+        self, frame: np.ndarray, max_faces: int, min_face_size: float, timings: Timings = None
+    ) -> Tuple[np.ndarray, List[Box]]:
+        """Все найденные лица, крупные первыми, не больше ``max_faces``."""
+        with _stage(timings, "detect"):
+            records = self._model.extract_faces(
+                img_path=frame,
+                detector_backend=self.detector_backend,
+                enforce_detection=False,
+                align=True,
+            )
+        found = []
+        for record in records:
+            box = _face_box(record)
+            if box is not None and min(box[2], box[3]) >= min_face_size:
+                found.append((box, record["face"]))
+        found.sort(key=lambda item: item[0][2] * item[0][3], reverse=True)
+        found = found[:max_faces]
+        if not found:
+            return np.empty((0, *FACE_SIZE, 1), dtype=np.float32), []
+        with _stage(timings, "align"):
+            faces = np.stack([_prepare_face(face) for _, face in found])
+        return faces, [box for box, _ in found]
+
+    def extract_faces(self, frame: np.ndarray, detect_face: bool = True) -> np.ndarray:
+        return self._detect(frame, detect_face)[0]
+
+    def classify_faces(self, faces: np.ndarray, timings: Timings = None) -> np.ndarray:
+        if not len(faces):
+            return np.empty((0, len(EMOTIONS)))
+        with _stage(timings, "infer"):
+            scores = self._batcher.predict(faces)
+        with _stage(timings, "normalize"):
+            return _normalize_emotion_matrix(scores)
+
+    def analyze_frames(
+        self, frames: List[np.ndarray], detect_face: bool = True, timings: Timings = None
+    ) -> List[Optional[Dict]]:
+        """Главное лицо каждого кадра; кропы всех кадров идут в модель одним батчем.
+
+        Без ``detect_face`` кадр без лица классифицируется целиком,
+        иначе для него возвращается None.
+        """
+        crops, boxes, owners = [], [], []
+        for index, frame in enumerate(frames):
+            faces, found = self._detect(frame, detect_face=False, timings=timings)
+            if not len(faces) or (detect_face and not found):
                 continue
-            response = requests.get(url, stream=True, timeout=60)
-            response.raise_for_status()
-            with target.open("wb") as handle:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        handle.write(chunk)
-
-    def analyze(self, image_bytes: bytes, detect_face: bool = True) -> Dict[str, float]:
-        frame = _load_image(image_bytes)
-        result = self._model.analyze(
-            img_path=frame,
-            actions=["emotion"],
-            enforce_detection=detect_face,
-            detector_backend=self.detector_backend,
-            align=True,
-            silent=True,
-        )
+            crops.append(faces[:1])
+            boxes.append(found[0] if found else None)
+            owners.append(index)
+        results: List[Optional[Dict]] = [None] * len(frames)
+        if not crops:
+            return results
+        scores = self.classify_faces(np.concatenate(crops), timings)
+        for owner, box, row in zip(owners, boxes, scores):
+            results[owner] = {
+                **_summarize(row),
+                "box": None if box is None else dict(zip(("x", "y", "w", "h"), box)),
+            }
+        return results
+
+    def analyze_video(
+        self,
+        path: str,
+        sampling: Optional[Sampling] = None,
+        detect_face: bool = True,
+        batch_size: Optional[int] = None,
+        timings: Timings = None,
+    ) -> Iterator[Dict]:
+        """Временная шкала эмоций ролика или GIF, кадр за кадром по мере декодирования."""
+        video = VideoFrames(path, self.detect_max_side)
+        try:
+            frames = video.sample(sampling or Sampling())
+            for batch in batched(frames, batch_size or self.max_batch_size):
+                results = self.analyze_frames([item.frame for item in batch], detect_face, timings)
+                for item, result in zip(batch, results):
+                    yield timeline_entry(item, result)
+        finally:
+            video.close()
+
+    def analyze(
+        self,
+        image_bytes: bytes,
+        detect_face: bool = True,
+        session_id: str | None = None,
+        timings: Timings = None,
+    ) -> Dict[str, float]:
+        """Эмоции главного лица; длительности этапов пишутся в ``timings``."""
+        with _stage(timings, "decode"):
+            frame = _load_image(
+                image_bytes, self.max_pixels, self.detect_max_side, self.decode_grayscale
+            )
+        if self.near_duplicates is None:
+            return self._analyze_frame(frame, detect_face, session_id, timings)
+
+        scope = (detect_face, self.detector_backend)
+        with _stage(timings, "near_duplicate"):
+            frame_hash = dhash(frame)
+            match = self.near_duplicates.lookup(scope, frame_hash)
+        if match is not None:
+            result, distance = match
+            return {**result, "near_duplicate": True, "near_duplicate_distance": distance}
+        result = self._analyze_frame(frame, detect_face, session_id, timings)
+        self.near_duplicates.add(scope, frame_hash, result)
+        return result
+
+    def analyze_faces(
+        self,
+        image_bytes: bytes,
+        max_faces: int | None = None,
+        min_face_size: int | None = None,
+        timings: Timings = None,
+    ) -> List[Dict]:
+        """Эмоции каждого лица на изображении; кропы идут в модель одним батчем.
+
+        Рамки и ``min_face_size`` заданы в пикселях исходного изображения.
+        """
+        with _stage(timings, "decode"):
+            frame = _load_image(
+                image_bytes, self.max_pixels, self.detect_max_side, self.decode_grayscale
+            )
+        size = _image_size(image_bytes)
+        scale = size[0] / frame.shape[1] if size else 1.0
+        max_faces = min(max_faces or self.max_faces, self.max_faces)
+        min_face_size = max(min_face_size or 0, self.min_face_size)
+        faces, boxes = self._detect_all(frame, max_faces, min_face_size / scale, timings)
+        scores = self.classify_faces(faces, timings)
+        return [
+            {
+                "box": {
+                    "x": round(x * scale),
+                    "y": round(y * scale),
+                    "w": round(w * scale),
+                    "h": round(h * scale),
+                },
+                **_summarize(row),
+            }
+            for (x, y, w, h), row in zip(boxes, scores)
+        ]
+
+    def _analyze_frame(
+        self,
+        frame: np.ndarray,
+        detect_face: bool,
+        session_id: str | None = None,
+        timings: Timings = None,
+    ) -> Dict[str, float]:
+        if self.inference_mode == "deepface":
+            return self._analyze_deepface(frame, detect_face, timings)
+        if session_id and self.tracker is not None:
+            return self._analyze_tracked(frame, detect_face, session_id, timings)
+        faces, _ = self._detect(frame, detect_face, timings)
+        scores = self.classify_faces(faces, timings)
+        if not len(scores):
+            return {"dominant": "neutral", "confidence": 1.0, "emotions": {"neutral": 1.0}}
+        return _summarize(scores[0])
+
+    def _analyze_tracked(
+        self, frame: np.ndarray, detect_face: bool, session_id: str, timings: Timings = None
+    ) -> Dict[str, float]:
+        with _stage(timings, "track"):
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            box = self.tracker.track(session_id, gray)
+        if box is not None:
+            x, y, w, h = box
+            with _stage(timings, "align"):
+                crop = _prepare_face(gray[y : y + h, x : x + w])[np.newaxis]
+            scores = self.classify_faces(crop, timings)
+            return {**_summarize(scores[0]), "tracked": True}
+
+        faces, boxes = self._detect(frame, detect_face, timings)
+        if boxes:
+            self.tracker.reset(session_id, gray, boxes[0])
+        else:
+            self.tracker.drop(session_id)
+        scores = self.classify_faces(faces, timings)
+        if not len(scores):
+            return {"dominant": "neutral", "confidence": 1.0, "emotions": {"neutral": 1.0}}
+        return {**_summarize(scores[0]), "tracked": False}
+
+    def _analyze_deepface(
+        self, frame: np.ndarray, detect_face: bool, timings: Timings = None
+    ) -> Dict[str, float]:
+        # DeepFace.analyze делает детекцию и классификацию за один вызов.
+        with _stage(timings, "detect_infer"):
+            result = self._model.analyze(
+                img_path=frame,
+                actions=["emotion"],
+                enforce_detection=detect_face,
+                detector_backend=self.detector_backend,
+                align=True,
+                silent=True,
+            )
         record = result[0] if isinstance(result, list) else result
         emotions = record.get("emotion") or {}
         if not emotions:
             return {"dominant": "neutral", "confidence": 1.0, "emotions": {"neutral": 1.0}}
 
-        normalized = _normalize_emotions(
-            {emotion: emotions.get(emotion, 0.0) for emotion in EMOTIONS}
-        )
+        with _stage(timings, "normalize"):
+            normalized = _normalize_emotions(
+                {emotion: emotions.get(emotion, 0.0) for emotion in EMOTIONS}
+            )
         dominant = max(normalized, key=normalized.get)
         return {
             "dominant": dominant,
@@ -101,29 +569,144 @@ class EmotionRecognizer:
         }
 
 
-recognizer = EmotionRecognizer()
+_recognizer: Optional[EmotionRecognizer] = None
+_recognizer_lock = threading.Lock()
+_by_detector: Dict[str, EmotionRecognizer] = {}
+
+
+def get_recognizer(detector_backend: str | None = None) -> EmotionRecognizer:
+    """Общий распознаватель; для другого детектора строится один раз и кешируется."""
+    base = _default_recognizer()
+    if not detector_backend or detector_backend == base.detector_backend:
+        return base
+    if detector_backend not in DETECTOR_BACKENDS:
+        raise ValueError(f"Unknown detector backend: {detector_backend}")
+    recognizer = _by_detector.get(detector_backend)
+    if recognizer is None:
+        with _recognizer_lock:
+            recognizer = _by_detector.get(detector_backend)
+            if recognizer is None:
+                started = time.perf_counter()
+                recognizer = base.with_detector(detector_backend)
+                logger.info(
+                    "Detector %s loaded in %.2fs",
+                    detector_backend,
+                    time.perf_counter() - started,
+                )
+                _by_detector[detector_backend] = recognizer
+    return recognizer
+
+
+def _default_recognizer() -> EmotionRecognizer:
+    global _recognizer
+    if _recognizer is None:
+        with _recognizer_lock:
+            if _recognizer is None:
+                started = time.perf_counter()
+                instance = EmotionRecognizer()
+                logger.info(
+                    "Recognizer loaded in %.2fs: %s",
+                    time.perf_counter() - started,
+                    ", ".join(f"{phase}={value:.2f}s" for phase, value in instance.load_timings.items()),
+                )
+                _recognizer = instance
+    return _recognizer
+
+
+class MemeFile(NamedTuple):
+    path: Path
+    size: int
+    mtime: float
+    meme_id: str
+
+
+def meme_id(relative: str, size: int) -> str:
+    """Id мема, одинаковый на всех репликах и при любом написании base_dir.
+
+    Хэшируются путь относительно base_dir и размер, файл не читается.
+    mtime не участвует: копирование и деплой его меняют.
+    """
+    return hashlib.sha1(f"{relative}|{size}".encode("utf-8")).hexdigest()[:20]
 
 
 class MemeStore:
-    def __init__(self, base_dir: str = "memes") -> None:
+    """Индекс мемов по эмоциям в памяти.
+
+    Конструктор диск не сканирует: индекс строит ``refresh()``, который API
+    вызывает в фоновом потоке раз в ``refresh_interval`` секунд. Папка
+    эмоции пересканируется, только когда меняется её mtime.
+    """
+
+    def __init__(self, base_dir: str = "memes", refresh_interval: float | None = None) -> None:
         self.base_path = Path(base_dir)
         self.base_path.mkdir(parents=True, exist_ok=True)
+        if refresh_interval is None:
+            refresh_interval = float(os.getenv("EMOTION_MEME_REFRESH", "5"))
+        self.refresh_interval = refresh_interval
+        self._files: Dict[str, List[MemeFile]] = {}
+        self._candidates: Dict[str, List[MemeFile]] = {}
+        self._by_id: Dict[str, MemeFile] = {}
+        self._mtimes: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _scan(self, folder: Path) -> List[MemeFile]:
+        files: List[MemeFile] = []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                identifier = meme_id(f"{folder.name}/{entry.name}", stat.st_size)
+                files.append(MemeFile(Path(entry.path), stat.st_size, stat.st_mtime, identifier))
+        return files
+
+    def refresh(self) -> None:
+        with self._lock:
+            files = dict(self._files)
+            changed = False
+            for emotion in EMOTIONS:
+                folder = self.base_path / emotion
+                try:
+                    mtime = folder.stat().st_mtime
+                except OSError:
+                    mtime = None
+                if emotion in files and self._mtimes.get(emotion) == mtime:
+                    continue
+                files[emotion] = self._scan(folder) if mtime is not None else []
+                self._mtimes[emotion] = mtime
+                changed = True
+            if changed:
+                fallback = files.get("neutral", [])
+                self._candidates = {
+                    emotion: items or fallback for emotion, items in files.items()
+                }
+                self._by_id = {
+                    meme.meme_id: meme for items in files.values() for meme in items
+                }
+                self._files = files
 
     def list_emotions(self) -> List[str]:
         return EMOTIONS
 
+    def files(self, emotion: str) -> List[MemeFile]:
+        return self._files.get(emotion, [])
+
     def has_meme(self, emotion: str) -> bool:
-        folder = self.base_path / emotion
-        return folder.exists() and any(folder.iterdir())
+        return bool(self._files.get(emotion))
+
+    def pick(self, emotion: str) -> MemeFile | None:
+        candidates = self._candidates.get(emotion)
+        return random.choice(candidates) if candidates else None
+
+    def get(self, meme_id: str) -> MemeFile | None:
+        return self._by_id.get(meme_id)
 
     def pick_random(self, emotion: str) -> Path | None:
-        folder = self.base_path / emotion
-        if not folder.exists():
-            return None
-        files = [item for item in folder.iterdir() if item.is_file()]
-        if not files and emotion != "neutral":
-            return self.pick_random("neutral")
-        return random.choice(files) if files else None
+        meme = self.pick(emotion)
+        return meme.path if meme else None
 
 
 memes = MemeStore()
\ No newline at end of file
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Экспорт модели эмоций в ONNX/TFLite и сравнение с эталонной Keras-моделью.
+
+``export`` собирает Keras-модель из facial_expression_model_weights.h5 и
+сохраняет её рядом с весами в ONNX (tf2onnx) и/или TFLite; с ``--int8``
+дополнительно пишется int8-вариант, откалиброванный на кропах лиц из
+локальной папки. ``compare`` меряет каждую модель в отдельном процессе:
+задержку на одно лицо, пропускную способность батчем, пиковую память и
+совпадение доминирующей эмоции с Keras.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import multiprocessing
+import resource
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from emotion_model import INPUT_SHAPE, exported_model_path, load_exported_model
+from emotion_recognition import (
+    EmotionRecognizer,
+    _load_image,
+    _prepare_face,
+    _weights_dir,
+)
+
+logger = logging.getLogger("emotion_api.export")
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+FORMATS = ("onnx", "tflite")
+ONNX_OPSET = 13
+
+
+def _keras_weights() -> Path:
+    return _weights_dir() / EmotionRecognizer._weights[0].filename
+
+
+def load_faces(folder: Path, limit: int = 500, detect: bool = False) -> np.ndarray:
+    """Кропы 48x48 из папки; без ``detect`` изображения считаются кропами лиц."""
+    paths = sorted(
+        path for path in folder.rglob("*") if path.suffix.lower() in IMAGE_SUFFIXES
+    )[:limit]
+    extract = None
+    if detect:
+        from deepface import DeepFace
+
+        extract = DeepFace.extract_faces
+    faces = []
+    for path in paths:
+        try:
+            frame = _load_image(path.read_bytes())
+            if extract is not None:
+                frame = extract(
+                    img_path=frame, detector_backend="opencv", enforce_detection=False
+                )[0]["face"]
+            faces.append(_prepare_face(frame))
+        except Exception as exc:
+            logger.warning("Skipping %s: %s", path, exc)
+    if not faces:
+        raise ValueError(f"No usable images under {folder}")
+    return np.stack(faces).astype(np.float32)
+
+
+def export_onnx(target: Path, calibration: Optional[np.ndarray] = None) -> List[Path]:
+    try:
+        import tf2onnx
+    except ImportError as exc:
+        raise ImportError("ONNX export needs tf2onnx: pip install tf2onnx") from exc
+    import tensorflow as tf
+
+    from emotion_model import build_keras_model
+
+    model = build_keras_model(_keras_weights())
+    signature = (tf.TensorSpec((None, *INPUT_SHAPE), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(
+        model, input_signature=signature, opset=ONNX_OPSET, output_path=str(target)
+    )
+    written = [target]
+    if calibration is not None:
+        written.append(_quantize_onnx(target, calibration))
+    return written
+
+
+def _quantize_onnx(source: Path, calibration: np.ndarray) -> Path:
+    try:
+        import onnxruntime as ort
+        from onnxruntime.quantization import (
+            CalibrationDataReader,
+            QuantFormat,
+            QuantType,
+            quantize_static,
+        )
+    except ImportError as exc:
+        raise ImportError("ONNX quantization needs onnxruntime: pip install onnxruntime") from exc
+
+    input_name = ort.InferenceSession(
+        str(source), providers=["CPUExecutionProvider"]
+    ).get_inputs()[0].name
+
+    class FaceReader(CalibrationDataReader):
+        def __init__(self) -> None:
+            self._batches = iter(np.array_split(calibration, max(1, len(calibration) // 16)))
+
+        def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+            batch = next(self._batches, None)
+            return None if batch is None else {input_name: batch}
+
+    target = exported_model_path(source.parent, "onnx", int8=True)
+    quantize_static(
+        str(source),
+        str(target),
+        FaceReader(),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+    )
+    return target
+
+
+def export_tflite(target: Path, calibration: Optional[np.ndarray] = None) -> List[Path]:
+    import tensorflow as tf
+
+    from emotion_model import build_keras_model
+
+    model = build_keras_model(_keras_weights())
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    target.write_bytes(converter.convert())
+    written = [target]
+    if calibration is not None:
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([face[np.newaxis]] for face in calibration)
+        # Внутри int8, вход и выход остаются float32 — рантайм не меняется.
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        quantized = exported_model_path(target.parent, "tflite", int8=True)
+        quantized.write_bytes(converter.convert())
+        written.append(quantized)
+    return written
+
+
+EXPORTERS = {"onnx": export_onnx, "tflite": export_tflite}
+
+
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _measure(fmt: str, path: Path, faces: np.ndarray, batch_size: int) -> Dict:
+    started = time.perf_counter()
+    if fmt == "keras":
+        from emotion_model import EmotionModel
+
+        model = EmotionModel(path, batch_size)
+    else:
+        model = load_exported_model(fmt, path, batch_size)
+    model.warmup()
+    load_seconds = time.perf_counter() - started
+
+    latencies = []
+    for face in faces:
+        single = time.perf_counter()
+        model.predict(face[np.newaxis])
+        latencies.append((time.perf_counter() - single) * 1000)
+    started = time.perf_counter()
+    scores = np.concatenate(
+        [model.predict(faces[i : i + batch_size]) for i in range(0, len(faces), batch_size)]
+    )
+    batch_seconds = time.perf_counter() - started
+    return {
+        "load_s": load_seconds,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "batch_faces_per_s": len(faces) / batch_seconds if batch_seconds else 0.0,
+        "rss_peak_mb": _peak_rss_mb(),
+        "top1": scores.argmax(axis=1).tolist(),
+    }
+
+
+def _measure_job(fmt: str, path: Path, faces: np.ndarray, batch_size: int) -> Dict:
+    try:
+        return _measure(fmt, path, faces, batch_size)
+    except Exception as exc:
+        return {"error": f"{exc.__class__.__name__}: {exc}"}
+
+
+def _candidates() -> List[Tuple[str, str, Path]]:
+    models = [("keras", "keras", _keras_weights())]
+    for fmt in FORMATS:
+        for int8 in (False, True):
+            path = exported_model_path(_weights_dir(), fmt, int8)
+            if path.exists():
+                models.append((path.name, fmt, path))
+    return models
+
+
+def compare(faces: np.ndarray, batch_size: int = 16) -> List[Dict]:
+    # spawn: у каждой модели свой процесс, и память одной не влияет на другую.
+    context = multiprocessing.get_context("spawn")
+    results = []
+    baseline: Optional[np.ndarray] = None
+    for name, fmt, path in _candidates():
+        with context.Pool(1) as pool:
+            stats = pool.apply(_measure_job, (fmt, path, faces, batch_size))
+        stats = {"model": name, "format": fmt, "size_mb": path.stat().st_size / 2**20, **stats}
+        top1 = stats.pop("top1", None)
+        if top1 is not None:
+            if baseline is None and fmt == "keras":
+                baseline = np.asarray(top1)
+            if baseline is not None:
+                stats["agreement"] = float(np.mean(np.asarray(top1) == baseline))
+        results.append(stats)
+    return results
+
+
+def print_table(results: List[Dict]) -> None:
+    print(
+        f"{'model':<36}{'size MB':>9}{'p50 ms':>9}{'p95 ms':>9}"
+        f"{'batch f/s':>11}{'rss MB':>9}{'load s':>8}{'agree':>8}"
+    )
+    for item in results:
+        if "error" in item:
+            print(f"{item['model']:<36}error: {item['error']}")
+            continue
+        agreement = f"{item['agreement']:.1%}" if "agreement" in item else "-"
+        print(
+            f"{item['model']:<36}{item['size_mb']:>9.2f}{item['p50_ms']:>9.2f}{item['p95_ms']:>9.2f}"
+            f"{item['batch_faces_per_s']:>11.0f}{item['rss_peak_mb']:>9.0f}{item['load_s']:>8.1f}"
+            f"{agreement:>8}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export and compare emotion model backends")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Convert the Keras weights to ONNX/TFLite")
+    export.add_argument("--format", choices=(*FORMATS, "all"), default="all")
+    export.add_argument("--int8", action="store_true", help="Also write int8-quantized models")
+    export.add_argument("--calibration-dir", help="Images for int8 calibration")
+
+    report = commands.add_parser("compare", help="Compare exported models with Keras")
+    report.add_argument("--images", required=True, help="Face images to run the models on")
+    report.add_argument("--batch-size", type=int, default=16)
+    report.add_argument("--output", help="Write results JSON here")
+
+    for sub in (export, report):
+        sub.add_argument("--limit", type=int, default=500, help="Max images to load")
+        sub.add_argument(
+            "--detect", action="store_true", help="Crop faces first instead of using whole images"
+        )
+    args = parser.parse_args()
+
+    if args.command == "export":
+        calibration = None
+        if args.int8:
+            if not args.calibration_dir:
+                parser.error("--int8 needs --calibration-dir")
+            calibration = load_faces(Path(args.calibration_dir), args.limit, args.detect)
+            logger.info("Calibrating on %d faces", len(calibration))
+        formats = FORMATS if args.format == "all" else (args.format,)
+        for fmt in formats:
+            for path in EXPORTERS[fmt](exported_model_path(_weights_dir(), fmt), calibration):
+                logger.info("Wrote %s (%.2f MB)", path, path.stat().st_size / 2**20)
+        return
+
+    faces = load_faces(Path(args.images), args.limit, args.detect)
+    results = compare(faces, args.batch_size)
+    print_table(results)
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+    sys.exit(1 if any("error" in item for item in results) else 0)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    main()
@@ -0,0 +1,118 @@
+"""
+Сопровождение лица между кадрами одной сессии.
+
+Полный детектор запускается раз в ``detect_every`` кадров или когда
+сопровождение теряет уверенность; в промежутках рамка лица ищется
+сопоставлением с шаблоном в окрестности прошлой позиции.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+Box = Tuple[int, int, int, int]
+
+TEMPLATE_SIDE = 64
+
+
+@dataclass
+class TrackState:
+    box: Box
+    template: np.ndarray
+    scale: float
+    frames_since_detect: int
+    updated_at: float
+
+
+class FaceTracker:
+    def __init__(
+        self,
+        detect_every: int = 10,
+        min_score: float = 0.5,
+        search_margin: float = 0.5,
+        ttl: float = 10.0,
+        max_sessions: int = 256,
+    ) -> None:
+        self.detect_every = detect_every
+        self.min_score = min_score
+        self.search_margin = search_margin
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, TrackState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional["FaceTracker"]:
+        detect_every = int(os.getenv("EMOTION_TRACK_DETECT_EVERY", "10"))
+        if detect_every <= 1:
+            return None
+        return cls(
+            detect_every=detect_every,
+            min_score=float(os.getenv("EMOTION_TRACK_MIN_SCORE", "0.5")),
+        )
+
+    def reset(self, session_id: str, gray: np.ndarray, box: Box) -> None:
+        x, y, w, h = box
+        if w <= 0 or h <= 0:
+            self.drop(session_id)
+            return
+        scale = min(1.0, TEMPLATE_SIDE / max(w, h))
+        template = cv2.resize(
+            gray[y : y + h, x : x + w], None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+        )
+        with self._lock:
+            self._sessions[session_id] = TrackState(box, template, scale, 0, time.monotonic())
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def drop(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def track(self, session_id: str, gray: np.ndarray) -> Optional[Box]:
+        """Новая рамка лица или None, если пора запускать детектор."""
+        with self._lock:
+            state = self._sessions.get(session_id)
+        if state is None:
+            return None
+        if (
+            state.frames_since_detect + 1 >= self.detect_every
+            or time.monotonic() - state.updated_at > self.ttl
+        ):
+            return None
+
+        x, y, w, h = state.box
+        height, width = gray.shape[:2]
+        margin_x, margin_y = int(w * self.search_margin), int(h * self.search_margin)
+        x0, y0 = max(0, x - margin_x), max(0, y - margin_y)
+        x1, y1 = min(width, x + w + margin_x), min(height, y + h + margin_y)
+        region = cv2.resize(
+            gray[y0:y1, x0:x1], None, fx=state.scale, fy=state.scale, interpolation=cv2.INTER_AREA
+        )
+        if region.shape[0] < state.template.shape[0] or region.shape[1] < state.template.shape[1]:
+            return None
+        scores = cv2.matchTemplate(region, state.template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, location = cv2.minMaxLoc(scores)
+        if score < self.min_score:
+            return None
+
+        box = (
+            max(0, min(width - w, x0 + int(location[0] / state.scale))),
+            max(0, min(height - h, y0 + int(location[1] / state.scale))),
+            w,
+            h,
+        )
+        with self._lock:
+            state.box = box
+            state.frames_since_detect += 1
+            state.updated_at = time.monotonic()
+        return box
@@ -0,0 +1,227 @@
+"""
+Ограниченный пул воркеров для инференса вне event loop.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import tracing
+
+POOL_MODES = ("thread", "process")
+
+
+class PoolSaturated(RuntimeError):
+    """Все слоты пула заняты, запрос нужно отклонить."""
+
+
+def _warm_worker() -> Dict[str, Any]:
+    from emotion_recognition import get_recognizer
+
+    return {"pid": os.getpid(), "load_timings": get_recognizer().load_timings}
+
+
+def _analyze(
+    payload: bytes,
+    detect_face: bool,
+    session_id: Optional[str],
+    trace_mode: Optional[str],
+    detector_backend: Optional[str],
+) -> Dict[str, Any]:
+    from emotion_recognition import get_recognizer
+
+    timings: Dict[str, float] = {}
+    with tracing.collect(trace_mode) as trace:
+        result = get_recognizer(detector_backend).analyze(
+            payload, detect_face=detect_face, session_id=session_id, timings=timings
+        )
+    return {**result, "timings": timings, "trace": trace}
+
+
+def _analyze_faces(
+    payload: bytes,
+    max_faces: Optional[int],
+    min_face_size: Optional[int],
+    trace_mode: Optional[str],
+    detector_backend: Optional[str],
+) -> Dict[str, Any]:
+    from emotion_recognition import get_recognizer
+
+    timings: Dict[str, float] = {}
+    with tracing.collect(trace_mode) as trace:
+        faces = get_recognizer(detector_backend).analyze_faces(
+            payload, max_faces=max_faces, min_face_size=min_face_size, timings=timings
+        )
+    return {"faces": faces, "timings": timings, "trace": trace}
+
+
+def _analyze_frames(
+    frames: List[Any],
+    detect_face: bool,
+    trace_mode: Optional[str],
+    detector_backend: Optional[str],
+) -> Dict[str, Any]:
+    from emotion_recognition import get_recognizer
+
+    timings: Dict[str, float] = {}
+    with tracing.collect(trace_mode) as trace:
+        results = get_recognizer(detector_backend).analyze_frames(
+            frames, detect_face=detect_face, timings=timings
+        )
+    return {"results": results, "timings": timings, "trace": trace}
+
+
+class InferencePool:
+    def __init__(self, mode: str = "thread", workers: int = 2, max_pending: int = 4) -> None:
+        if mode not in POOL_MODES:
+            raise ValueError(f"Unknown pool mode: {mode}")
+        if workers < 1:
+            raise ValueError("Pool needs at least one worker")
+        self.mode = mode
+        self.workers = workers
+        self.max_pending = max(0, max_pending)
+        self.capacity = self.workers + self.max_pending
+        self._slots = asyncio.Semaphore(self.capacity)
+        self._in_flight = 0
+        self._rejected = 0
+        self._executor: Executor | None = None
+        self._warmup: List[Future] = []
+
+    @classmethod
+    def from_env(cls) -> "InferencePool":
+        workers = int(os.getenv("EMOTION_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+        return cls(
+            mode=os.getenv("EMOTION_POOL_MODE", "thread").lower(),
+            workers=workers,
+            max_pending=int(os.getenv("EMOTION_POOL_QUEUE", str(workers * 2))),
+        )
+
+    def _build_executor(self) -> Executor:
+        if self.mode == "process":
+            # spawn: TensorFlow не переживает fork родителя с уже поднятым рантаймом
+            return ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        # Потоки разделяют один прогретый recognizer процесса.
+        return ThreadPoolExecutor(
+            max_workers=self.workers,
+            thread_name_prefix="emotion-infer",
+        )
+
+    def start(self) -> None:
+        """Поднимает воркеры и в фоне загружает в них модель."""
+        if self._executor is not None:
+            return
+        self._executor = self._build_executor()
+        self._warmup = [self._executor.submit(_warm_worker) for _ in range(self.workers)]
+
+    @property
+    def state(self) -> str:
+        if not self._warmup:
+            return "stopped"
+        if not all(future.done() for future in self._warmup):
+            return "loading"
+        return "failed" if self.load_error else "ready"
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    @property
+    def load_error(self) -> Optional[str]:
+        for future in self._warmup:
+            if future.done() and not future.cancelled() and future.exception() is not None:
+                return repr(future.exception())
+        return None
+
+    async def wait_ready(self) -> str:
+        await asyncio.gather(
+            *(asyncio.wrap_future(future) for future in self._warmup),
+            return_exceptions=True,
+        )
+        return self.state
+
+    def load_report(self) -> List[Dict[str, Any]]:
+        return [
+            future.result()
+            for future in self._warmup
+            if future.done() and not future.cancelled() and future.exception() is None
+        ]
+
+    async def run(self, fn: Callable[..., Any], *args: Any, wait: bool = False) -> Any:
+        if not wait and self._slots.locked():
+            self._rejected += 1
+            raise PoolSaturated("Inference pool is full")
+        async with self._slots:
+            self._in_flight += 1
+            try:
+                self.start()
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._executor, fn, *args)
+            finally:
+                self._in_flight -= 1
+
+    async def analyze(
+        self,
+        payload: bytes,
+        detect_face: bool,
+        wait: bool = False,
+        session_id: Optional[str] = None,
+        trace_mode: Optional[str] = None,
+        detector_backend: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        return await self.run(
+            _analyze, payload, detect_face, session_id, trace_mode, detector_backend, wait=wait
+        )
+
+    async def analyze_faces(
+        self,
+        payload: bytes,
+        max_faces: Optional[int] = None,
+        min_face_size: Optional[int] = None,
+        wait: bool = False,
+        trace_mode: Optional[str] = None,
+        detector_backend: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        return await self.run(
+            _analyze_faces,
+            payload,
+            max_faces,
+            min_face_size,
+            trace_mode,
+            detector_backend,
+            wait=wait,
+        )
+
+    async def analyze_frames(
+        self,
+        frames: List[Any],
+        detect_face: bool = True,
+        wait: bool = False,
+        trace_mode: Optional[str] = None,
+        detector_backend: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        return await self.run(
+            _analyze_frames, frames, detect_face, trace_mode, detector_backend, wait=wait
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "mode": self.mode,
+            "workers": self.workers,
+            "capacity": self.capacity,
+            "in_flight": self._in_flight,
+            "rejected": self._rejected,
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._warmup = []
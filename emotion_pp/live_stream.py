@@ -0,0 +1,115 @@
+"""
+Сессия живого видео по WebSocket: клиент шлёт JPEG-кадры, сервер
+обрабатывает только самый свежий и возвращает результаты с frame_id.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import math
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional
+
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+
+
+@dataclass
+class Frame:
+    frame_id: int
+    payload: bytes
+    received_at: float
+
+
+class LatestFrameSlot:
+    """Слот на один кадр: новый кадр вытесняет необработанный старый."""
+
+    def __init__(self) -> None:
+        self._frame: Optional[Frame] = None
+        self._ready = asyncio.Event()
+        self.dropped = 0
+
+    def put(self, frame: Frame) -> None:
+        if self._frame is not None:
+            self.dropped += 1
+        self._frame = frame
+        self._ready.set()
+
+    async def take(self) -> Frame:
+        while self._frame is None:
+            self._ready.clear()
+            await self._ready.wait()
+        frame, self._frame = self._frame, None
+        return frame
+
+
+async def run_session(
+    websocket: WebSocket,
+    classify: Callable[[bytes], Awaitable[Dict]],
+    max_fps: float,
+    max_in_flight: int,
+) -> Dict[str, int]:
+    slot = LatestFrameSlot()
+    counters = {"received": 0, "processed": 0, "busy": 0}
+    min_interval = 1.0 / max_fps if max_fps > 0 else 0.0
+    next_start = -math.inf
+
+    async def receive() -> None:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            payload = message.get("bytes")
+            if not payload:
+                continue
+            counters["received"] += 1
+            slot.put(Frame(counters["received"], payload, time.perf_counter()))
+
+    async def process() -> None:
+        nonlocal next_start
+        while True:
+            # Лимит FPS ждёт до следующего слота, а кадр берётся уже после
+            # ожидания, поэтому в обработку идёт самый свежий.
+            delay = next_start - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            frame = await slot.take()
+            started = time.perf_counter()
+            next_start = max(next_start, started) + min_interval
+            try:
+                body = await classify(frame.payload)
+            except HTTPException as exc:
+                if exc.status_code == 503:
+                    counters["busy"] += 1
+                    slot.dropped += 1
+                    continue
+                body = {"error": exc.detail}
+            except Exception as exc:
+                body = {"error": str(exc) or exc.__class__.__name__}
+            finished = time.perf_counter()
+            counters["processed"] += 1
+            body.update(
+                frame_id=frame.frame_id,
+                dropped=slot.dropped,
+                timings={
+                    "queue_ms": (started - frame.received_at) * 1000,
+                    "inference_ms": (finished - started) * 1000,
+                    "server_ms": (finished - frame.received_at) * 1000,
+                },
+            )
+            await websocket.send_text(json.dumps(body, ensure_ascii=False))
+
+    receiver = asyncio.create_task(receive())
+    workers = [asyncio.create_task(process()) for _ in range(max(1, max_in_flight))]
+    try:
+        done, _ = await asyncio.wait([receiver, *workers], return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            error = task.exception()
+            if error is not None and not isinstance(error, WebSocketDisconnect):
+                raise error
+    finally:
+        for task in (receiver, *workers):
+            task.cancel()
+        await asyncio.gather(receiver, *workers, return_exceptions=True)
+    return {**counters, "dropped": slot.dropped}
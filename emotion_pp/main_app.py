@@ -1,20 +1,45 @@
 """
 Главное приложение для классификации эмоций
 Поддерживает два режима: загрузка фото и потоковое видео
+
+Непрерывный поток берёт камеру в браузере пользователя через
+streamlit-webrtc. Без этого пакета остаётся запасной режим: кадры читает
+cv2.VideoCapture на машине, где запущен Streamlit, и он работает, только
+когда браузер открыт на том же компьютере.
 """
 import streamlit as st
 import requests
 import json
-from PIL import Image
+from PIL import Image, ImageOps
 import io
 import cv2
 import numpy as np
 import time
 from datetime import datetime
-import base64
 import threading
 from typing import Optional
 import queue
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from websockets.exceptions import WebSocketException
+from websockets.sync.client import connect as ws_connect
+
+try:
+    import av
+    from streamlit_webrtc import WebRtcMode, webrtc_streamer
+except ImportError:
+    webrtc_streamer = None
+
+# Бюджеты кадра перед отправкой на API: модели хватает небольшого разрешения
+UPLOAD_MAX_SIDE = 640
+UPLOAD_MAX_BYTES = 150_000
+STREAM_MAX_BYTES = 40_000
+JPEG_QUALITIES = (85, 75, 65, 50, 35)
+
+# Пул соединений и TTL кэша статичных ответов API
+HTTP_POOL_SIZE = 16
+EMOTIONS_TTL = 300
+HEALTH_TTL = 5
 
 # Настройка страницы
 st.set_page_config(
@@ -103,13 +128,44 @@ analysis_type = st.sidebar.radio(
 )
 detect_face = analysis_type == "👤 Лицо человека"
 
+# Общий HTTP-клиент: одна сессия с пулом соединений на процесс Streamlit
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+@st.cache_resource
+def get_prefetch_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="meme-prefetch")
+
+@st.cache_data(ttl=HEALTH_TTL, show_spinner=False)
+def fetch_health(api_url: str) -> Optional[dict]:
+    """Статус API; None, если сервер недоступен"""
+    try:
+        response = get_http_session().get(f"{api_url}/health", timeout=2)
+    except requests.exceptions.RequestException:
+        return None
+    return response.json() if response.status_code == 200 else None
+
+@st.cache_data(ttl=EMOTIONS_TTL, show_spinner=False)
+def fetch_emotions(api_url: str) -> Optional[list]:
+    """Список эмоций API; None, если сервер недоступен"""
+    try:
+        response = get_http_session().get(f"{api_url}/emotions", timeout=2)
+    except requests.exceptions.RequestException:
+        return None
+    return response.json()["emotions"] if response.status_code == 200 else None
+
 # Функция для отправки изображения на API
 def classify_image(image_bytes: bytes, filename: str = "image.jpg", detect_face: bool = True) -> Optional[dict]:
     """Отправка изображения на API для классификации"""
     try:
         files = {"file": (filename, image_bytes, "image/jpeg")}
         params = {"detect_face": detect_face}
-        response = requests.post(f"{api_url}/classify", files=files, params=params, timeout=10)
+        response = get_http_session().post(f"{api_url}/classify", files=files, params=params, timeout=10)
         if response.status_code == 200:
             return response.json()
         else:
@@ -123,20 +179,206 @@ def classify_image(image_bytes: bytes, filename: str = "image.jpg", detect_face:
         return None
 
 # Функция для получения мема
+def fetch_meme(emotion: str, api_url: str) -> Optional[bytes]:
+    """Байты случайного мема для эмоции; безопасно вызывать из фонового потока"""
+    response = get_http_session().get(
+        f"{api_url}/meme/{emotion}", params={"size": "medium"}, timeout=5
+    )
+    return response.content if response.status_code == 200 else None
+
+def prefetch_meme(emotion: str, api_url: str):
+    """Запуск загрузки мема параллельно с отрисовкой результата"""
+    prefetched = st.session_state.get('meme_prefetch')
+    if prefetched is None or prefetched[0] != emotion:
+        future = get_prefetch_executor().submit(fetch_meme, emotion, api_url)
+        st.session_state.meme_prefetch = (emotion, future)
+
 def get_meme(emotion: str, api_url: str) -> Optional[Image.Image]:
-    """Получение случайного мема для эмоции"""
+    """Получение случайного мема для эмоции, с учётом предзагруженного"""
     try:
-        response = requests.get(f"{api_url}/meme/{emotion}/base64", timeout=5)
-        if response.status_code == 200:
-            data = response.json()
-            image_data = data['image'].split(',')[1]  # Убираем data:image/jpeg;base64,
-            image_bytes = base64.b64decode(image_data)
-            return Image.open(io.BytesIO(image_bytes))
-        return None
+        prefetched = st.session_state.pop('meme_prefetch', None)
+        if prefetched is not None and prefetched[0] == emotion:
+            content = prefetched[1].result()
+        else:
+            content = fetch_meme(emotion, api_url)
+        return Image.open(io.BytesIO(content)) if content else None
     except Exception as e:
         st.warning(f"Не удалось загрузить мем: {e}")
         return None
 
+# Подготовка изображений перед отправкой
+def encode_for_upload(frame_bgr: np.ndarray, max_side: int = UPLOAD_MAX_SIDE, max_bytes: int = UPLOAD_MAX_BYTES) -> bytes:
+    """Уменьшение кадра и JPEG-сжатие в пределах бюджета по размеру"""
+    height, width = frame_bgr.shape[:2]
+    scale = max_side / max(height, width)
+    if scale < 1:
+        frame_bgr = cv2.resize(frame_bgr, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+    for quality in JPEG_QUALITIES:
+        ok, encoded = cv2.imencode(".jpg", frame_bgr, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if ok and len(encoded) <= max_bytes:
+            break
+    return encoded.tobytes()
+
+def prepare_photo(image_bytes: bytes) -> bytes:
+    """Загруженное фото в уменьшенный JPEG с учётом EXIF-поворота"""
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes))).convert("RGB")
+    return encode_for_upload(cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR))
+
+def draw_overlay(frame_bgr: np.ndarray, result: Optional[dict]) -> np.ndarray:
+    """Подпись с доминирующей эмоцией поверх кадра"""
+    if not result:
+        return frame_bgr
+    frame_bgr = frame_bgr.copy()
+    text = f"{result['dominant_emotion'].upper()}: {result['confidence']:.1%}"
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    font_scale = 1
+    thickness = 2
+    (text_width, text_height), baseline = cv2.getTextSize(text, font, font_scale, thickness)
+    cv2.rectangle(frame_bgr, (10, 10), (text_width + 20, text_height + 30), (0, 0, 0), -1)
+    cv2.putText(frame_bgr, text, (15, text_height + 20), font, font_scale, (0, 255, 0), thickness)
+    return frame_bgr
+
+# Непрерывный захват с камеры через WebSocket
+def render_live_result(slot, result: Optional[dict], stats: dict):
+    """Обновление панели результата на месте, без перезапуска страницы"""
+    with slot.container():
+        if result:
+            st.markdown(f"""
+            <div class="emotion-card">
+                <h2>{result['dominant_emotion'].upper()}</h2>
+                <h3>Уверенность: {result['confidence']:.1%}</h3>
+            </div>
+            """, unsafe_allow_html=True)
+            for emotion, prob in sorted(result['emotions'].items(), key=lambda x: x[1], reverse=True):
+                st.progress(prob, text=f"{emotion.title()}: {prob:.1%}")
+        else:
+            st.info("⏳ Ожидание первого результата...")
+        st.caption(
+            f"Отправлено кадров: {stats['sent']} · получено результатов: {stats['received']} · "
+            f"размер кадра: {stats['frame_kb']:.1f} КБ · задержка сервера: {stats['server_ms']:.0f} мс"
+        )
+
+def stream_url(detect_face: bool, target_fps: int) -> str:
+    ws_url = api_url.replace("http://", "ws://", 1).replace("https://", "wss://", 1)
+    return f"{ws_url}/ws/classify?detect_face={str(detect_face).lower()}&max_fps={target_fps}"
+
+def drain_results(ws, stats: dict) -> Optional[dict]:
+    """Все готовые ответы API без ожидания; последний удачный результат"""
+    result = None
+    try:
+        while True:
+            message = json.loads(ws.recv(timeout=0))
+            stats["received"] += 1
+            if "error" not in message:
+                result = message
+                stats["server_ms"] = message["timings"]["server_ms"]
+    except TimeoutError:
+        pass
+    return result
+
+class BrowserStream:
+    """Кадры камеры браузера (streamlit-webrtc) уходят на API по одному WebSocket"""
+
+    def __init__(self, url: str, target_fps: int, max_side: int):
+        self.url = url
+        self.target_fps = target_fps
+        self.max_side = max_side
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.stats = {"sent": 0, "received": 0, "frame_kb": 0.0, "server_ms": 0.0}
+        # Только последний кадр: если API не успевает, старые кадры выбрасываются
+        self._frames: queue.Queue = queue.Queue(maxsize=1)
+        self._stopped = threading.Event()
+        threading.Thread(target=self._send_loop, daemon=True).start()
+
+    def recv(self, frame):
+        image = frame.to_ndarray(format="bgr24")
+        try:
+            self._frames.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            self._frames.put_nowait(image)
+        except queue.Full:
+            pass
+        return av.VideoFrame.from_ndarray(draw_overlay(image, self.result), format="bgr24")
+
+    def on_ended(self):
+        self._stopped.set()
+
+    def _send_loop(self):
+        try:
+            with ws_connect(self.url, max_size=None) as ws:
+                next_tick = time.monotonic()
+                while not self._stopped.is_set():
+                    try:
+                        image = self._frames.get(timeout=0.5)
+                    except queue.Empty:
+                        continue
+                    if time.monotonic() < next_tick:
+                        continue
+                    next_tick = time.monotonic() + 1.0 / self.target_fps
+                    payload = encode_for_upload(image, self.max_side, STREAM_MAX_BYTES)
+                    ws.send(payload)
+                    self.stats["sent"] += 1
+                    self.stats["frame_kb"] = len(payload) / 1024
+                    self.result = drain_results(ws, self.stats) or self.result
+        except (OSError, WebSocketException) as e:
+            self.error = str(e)
+
+def watch_browser_stream(ctx, result_slot):
+    """Обновление панели результата, пока браузер шлёт видео"""
+    while ctx.state.playing:
+        processor = ctx.video_processor
+        if processor is not None:
+            if processor.error:
+                result_slot.error(f"❌ Не удается открыть поток к API: {processor.error}")
+                return
+            if processor.result:
+                st.session_state.last_result = processor.result
+            render_live_result(result_slot, processor.result, processor.stats)
+        time.sleep(0.5)
+
+def run_stream(camera_index: int, target_fps: int, max_side: int, detect_face: bool, frame_slot, result_slot):
+    """Запасной режим без streamlit-webrtc: камера машины, где запущен Streamlit"""
+    capture = cv2.VideoCapture(camera_index)
+    if not capture.isOpened():
+        st.error(f"❌ Камера {camera_index} недоступна")
+        return
+    capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    interval = 1.0 / target_fps
+    result = st.session_state.last_result
+    stats = {"sent": 0, "received": 0, "frame_kb": 0.0, "server_ms": 0.0}
+    try:
+        with ws_connect(stream_url(detect_face, target_fps), max_size=None) as ws:
+            next_tick = time.monotonic()
+            while True:
+                delay = next_tick - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_tick = max(next_tick + interval, time.monotonic())
+
+                ok, frame = capture.read()
+                if not ok:
+                    st.warning("⚠️ Не удалось получить кадр с камеры")
+                    break
+                payload = encode_for_upload(frame, max_side, STREAM_MAX_BYTES)
+                ws.send(payload)
+                stats["sent"] += 1
+                stats["frame_kb"] = len(payload) / 1024
+
+                # Забираем все готовые ответы, не дожидаясь текущего кадра
+                latest = drain_results(ws, stats)
+                if latest:
+                    result = st.session_state.last_result = latest
+
+                frame_slot.image(draw_overlay(frame, result), channels="BGR", use_column_width=True)
+                render_live_result(result_slot, result, stats)
+    except (OSError, WebSocketException) as e:
+        st.error(f"❌ Не удается открыть поток к API: {e}")
+    finally:
+        capture.release()
+
 # Функция для отображения результатов
 def display_results(result: dict, api_url: str):
     """Отображение результатов анализа эмоций"""
@@ -148,6 +390,8 @@ def display_results(result: dict, api_url: str):
     dominant_emotion = result['dominant_emotion']
     confidence = result['confidence']
     emoji = emotion_emojis.get(dominant_emotion, '😐')
+    if result.get('meme_available', False):
+        prefetch_meme(dominant_emotion, api_url)
     
     st.markdown(f"""
     <div class="emotion-card">
@@ -240,8 +484,8 @@ if st.session_state.mode == 'photo':
             # Кнопка анализа
             if st.button("🔍 Анализировать эмоции", type="primary"):
                 with st.spinner("Анализируем эмоции..."):
-                    # Конвертация в bytes
-                    img_bytes = uploaded_file.getvalue()
+                    # Уменьшение и сжатие перед отправкой
+                    img_bytes = prepare_photo(uploaded_file.getvalue())
                     result = classify_image(img_bytes, uploaded_file.name, detect_face=detect_face)
                     
                     if result:
@@ -288,79 +532,103 @@ if st.session_state.mode == 'photo':
 # Режим потокового видео
 else:
     st.subheader("📹 Потоковое видео с камеры")
-    
+
+    capture_mode = st.radio(
+        "Способ захвата",
+        ["🎥 Непрерывный поток", "📷 Снимок"],
+        horizontal=True,
+        help="Непрерывный поток берёт камеру в браузере (нужен streamlit-webrtc)"
+    )
+    streaming = False
+    stream_ctx = None
+
     col1, col2 = st.columns([1, 1])
-    
-    with col1:
-        st.markdown("""
-        <div class="info-box">
-            <strong>Инструкция:</strong><br>
-            1. Разрешите доступ к камере<br>
-            2. Направьте камеру на лицо<br>
-            3. Нажмите кнопку для захвата кадра<br>
-            4. Эмоции будут проанализированы автоматически
-        </div>
-        """, unsafe_allow_html=True)
-        
-        # Использование streamlit camera_input
-        camera_image = st.camera_input(
-            "Включите камеру для анализа эмоций",
-            help="Нажмите на камеру для захвата кадра"
-        )
-        
-        if camera_image is not None:
-            # Автоматический анализ при захвате кадра
-            if not st.session_state.processing:
-                st.session_state.processing = True
-                
-                with st.spinner("Анализируем эмоции..."):
-                    # Конвертация изображения
-                    img_bytes = camera_image.getvalue()
-                    result = classify_image(img_bytes, "camera_frame.jpg", detect_face=detect_face)
-                    
-                    if result:
-                        st.session_state.last_result = result
-                        st.session_state.processing = False
-                        
-                        # Отображение результата на изображении
-                        img_array = np.array(Image.open(io.BytesIO(img_bytes)))
-                        
-                        # Добавление текста с эмоцией на изображение
-                        dominant_emotion = result['dominant_emotion']
-                        confidence = result['confidence']
-                        
-                        # Конвертация в OpenCV формат для обработки
-                        img_cv = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
-                        
-                        # Добавление текста с эмоцией
-                        text = f"{dominant_emotion.upper()}: {confidence:.1%}"
-                        font = cv2.FONT_HERSHEY_SIMPLEX
-                        font_scale = 1
-                        thickness = 2
-                        
-                        # Получение размеров текста
-                        (text_width, text_height), baseline = cv2.getTextSize(text, font, font_scale, thickness)
-                        
-                        # Рисование прямоугольника для текста
-                        cv2.rectangle(img_cv, (10, 10), (text_width + 20, text_height + 30), (0, 0, 0), -1)
-                        cv2.putText(img_cv, text, (15, text_height + 20), 
-                                  font, font_scale, (0, 255, 0), thickness)
-                        
-                        # Конвертация обратно в RGB
-                        img_rgb = cv2.cvtColor(img_cv, cv2.COLOR_BGR2RGB)
-                        
-                        st.image(img_rgb, caption="Результат анализа", use_column_width=True)
-                        
-                        analysis_mode = "лица" if detect_face else "мема"
-                        st.success(f"✅ Анализ {analysis_mode} завершен!")
-            
-            # Кнопка для повторного анализа
-            if st.button("🔄 Анализировать снова", type="primary"):
-                st.session_state.processing = False
-                st.rerun()
-    
+
+    if capture_mode == "🎥 Непрерывный поток":
+        with col1:
+            st.markdown("""
+            <div class="info-box">
+                <strong>Инструкция:</strong><br>
+                1. Выберите целевой FPS и размер кадра<br>
+                2. Запустите поток и разрешите доступ к камере<br>
+                3. Эмоции обновляются на кадре и справа без перезагрузки страницы
+            </div>
+            """, unsafe_allow_html=True)
+
+            settings1, settings2 = st.columns(2)
+            with settings1:
+                target_fps = st.slider("Целевой FPS", min_value=1, max_value=15, value=5)
+            with settings2:
+                max_side = st.select_slider("Размер кадра", options=[240, 320, 480, 640], value=320)
+
+            if webrtc_streamer is not None:
+                stream_ctx = webrtc_streamer(
+                    key="emotion-stream",
+                    mode=WebRtcMode.SENDRECV,
+                    video_processor_factory=lambda: BrowserStream(
+                        stream_url(detect_face, target_fps), target_fps, max_side
+                    ),
+                    media_stream_constraints={"video": True, "audio": False},
+                    async_processing=True,
+                )
+                if stream_ctx.video_processor is not None:
+                    stream_ctx.video_processor.target_fps = target_fps
+                    stream_ctx.video_processor.max_side = max_side
+            else:
+                st.warning(
+                    "⚠️ streamlit-webrtc не установлен: поток читает камеру компьютера, "
+                    "на котором запущен Streamlit, и работает, только если браузер открыт на нём же"
+                )
+                camera_index = st.number_input("Камера", min_value=0, max_value=9, value=0, step=1)
+                streaming = st.toggle("▶️ Запустить поток", key="streaming")
+                frame_slot = st.empty()
+    else:
+        with col1:
+            st.markdown("""
+            <div class="info-box">
+                <strong>Инструкция:</strong><br>
+                1. Разрешите доступ к камере<br>
+                2. Направьте камеру на лицо<br>
+                3. Нажмите кнопку для захвата кадра<br>
+                4. Эмоции будут проанализированы автоматически
+            </div>
+            """, unsafe_allow_html=True)
+
+            # Использование streamlit camera_input
+            camera_image = st.camera_input(
+                "Включите камеру для анализа эмоций",
+                help="Нажмите на камеру для захвата кадра"
+            )
+
+            if camera_image is not None:
+                # Автоматический анализ при захвате кадра
+                if not st.session_state.processing:
+                    st.session_state.processing = True
+
+                    with st.spinner("Анализируем эмоции..."):
+                        img_bytes = prepare_photo(camera_image.getvalue())
+                        result = classify_image(img_bytes, "camera_frame.jpg", detect_face=detect_face)
+
+                        if result:
+                            st.session_state.last_result = result
+                            st.session_state.processing = False
+
+                            # Отображение результата на изображении
+                            img_cv = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_COLOR)
+                            st.image(draw_overlay(img_cv, result), channels="BGR", caption="Результат анализа", use_column_width=True)
+
+                            analysis_mode = "лица" if detect_face else "мема"
+                            st.success(f"✅ Анализ {analysis_mode} завершен!")
+
+                # Кнопка для повторного анализа
+                if st.button("🔄 Анализировать снова", type="primary"):
+                    st.session_state.processing = False
+                    st.rerun()
+
     with col2:
-        if st.session_state.last_result:
+        if streaming or (stream_ctx is not None and stream_ctx.state.playing):
+            result_slot = st.empty()
+        elif st.session_state.last_result:
             result = st.session_state.last_result
             # Показать режим анализа
             if 'mode' in result:
@@ -432,29 +700,29 @@ st.markdown("""
 
 # Проверка доступности API
 st.sidebar.markdown("### 🔌 Статус API")
-try:
-    response = requests.get(f"{api_url}/health", timeout=2)
-    if response.status_code == 200:
-        health_data = response.json()
-        if health_data.get('model_loaded'):
-            st.sidebar.success("✅ API онлайн\n✅ Модель загружена")
-        else:
-            st.sidebar.warning("⚠️ API онлайн\n❌ Модель не загружена")
-    else:
-        st.sidebar.error("❌ API недоступен")
-except:
+health_data = fetch_health(api_url)
+if health_data is None:
     st.sidebar.error("❌ API недоступен\nПроверьте подключение")
+elif health_data.get('model_loaded'):
+    st.sidebar.success("✅ API онлайн\n✅ Модель загружена")
+else:
+    st.sidebar.warning("⚠️ API онлайн\n❌ Модель не загружена")
 
 # Информация о доступных эмоциях
 st.sidebar.markdown("### 📝 Доступные эмоции")
-try:
-    response = requests.get(f"{api_url}/emotions", timeout=2)
-    if response.status_code == 200:
-        emotions_data = response.json()
-        for emotion in emotions_data['emotions']:
-            emoji = {'angry': '😠', 'disgust': '🤢', 'fear': '😨',
-                    'happy': '😊', 'sad': '😢', 'surprise': '😲', 'neutral': '😐'}
-            st.sidebar.write(f"{emoji.get(emotion, '😐')} {emotion.title()}")
-except:
+available_emotions = fetch_emotions(api_url)
+if available_emotions:
+    for emotion in available_emotions:
+        emoji = {'angry': '😠', 'disgust': '🤢', 'fear': '😨',
+                'happy': '😊', 'sad': '😢', 'surprise': '😲', 'neutral': '😐'}
+        st.sidebar.write(f"{emoji.get(emotion, '😐')} {emotion.title()}")
+else:
     st.sidebar.write("😠 Angry\n🤢 Disgust\n😨 Fear\n😊 Happy\n😢 Sad\n😲 Surprise\n😐 Neutral")
 
+# Циклы потока — в самом конце: пока они идут, код ниже не выполняется,
+# поэтому футер и боковая панель отрисованы заранее
+if st.session_state.mode == 'video':
+    if stream_ctx is not None and stream_ctx.state.playing:
+        watch_browser_stream(stream_ctx, result_slot)
+    elif streaming:
+        run_stream(int(camera_index), target_fps, max_side, detect_face, frame_slot, result_slot)
@@ -0,0 +1,191 @@
+"""
+Отдача мемов в бинарном виде: ETag/Last-Modified, условные GET, Range
+и LRU-кэш горячих файлов в памяти.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Iterator, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+from emotion_recognition import MemeFile
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Запрошенного варианта ещё нет, отдаётся оригинал: после сборки вариантов
+# по тому же адресу будут другие байты, поэтому надолго кэшировать нельзя.
+FALLBACK = "public, max-age=60"
+CHUNK_SIZE = 64 * 1024
+
+
+class BytesLRU:
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._items.get(key)
+            if data is None:
+                self._misses += 1
+                return None
+            self._items.move_to_end(key)
+            self._hits += 1
+            return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._items[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "items": len(self._items),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+            }
+
+
+def content_type(meme: MemeFile) -> str:
+    return mimetypes.guess_type(meme.path.name)[0] or "application/octet-stream"
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Разбирает одиночный диапазон ``bytes=a-b``.
+
+    Мульти-диапазоны и синтаксически неверный заголовок игнорируются (None,
+    ответ 200 целиком, RFC 9110); ValueError только для корректного, но
+    невыполнимого диапазона — это 416.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_text, dash, end_text = (part.strip() for part in spec.strip().partition("-"))
+    numbers = [text for text in (start_text, end_text) if text]
+    if not dash or not numbers or not all(text.isascii() and text.isdigit() for text in numbers):
+        return None
+    if not start_text:
+        length = int(end_text)
+        if length == 0:
+            raise ValueError(f"Unsatisfiable range: {header}")
+        return max(0, size - length), size - 1
+    start = int(start_text)
+    if end_text and int(end_text) < start:
+        return None
+    if start >= size:
+        raise ValueError(f"Unsatisfiable range: {header}")
+    return start, min(int(end_text), size - 1) if end_text else size - 1
+
+
+def _iter_file(meme: MemeFile, start: int, end: int) -> Iterator[bytes]:
+    with meme.path.open("rb") as handle:
+        handle.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = handle.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+class MemeDelivery:
+    def __init__(self, max_bytes: int | None = None, max_item_bytes: int | None = None) -> None:
+        if max_bytes is None:
+            max_bytes = int(float(os.getenv("EMOTION_MEME_CACHE_MB", "64")) * 1024 * 1024)
+        self.cache = BytesLRU(max_bytes)
+        self.max_item_bytes = max_item_bytes if max_item_bytes is not None else max_bytes // 8
+
+    async def read(self, meme: MemeFile) -> Optional[bytes]:
+        """Байты мема из кэша; None, если файл слишком велик для кэша."""
+        if meme.size > self.max_item_bytes:
+            return None
+        data = self.cache.get(meme.meme_id)
+        if data is None:
+            data = await asyncio.to_thread(meme.path.read_bytes)
+            self.cache.put(meme.meme_id, data)
+        return data
+
+    async def read_all(self, meme: MemeFile) -> bytes:
+        data = await self.read(meme)
+        if data is None:
+            data = await asyncio.to_thread(meme.path.read_bytes)
+        return data
+
+    async def respond(self, request: Request, meme: MemeFile, cache_control: str = IMMUTABLE) -> Response:
+        etag = f'"{meme.meme_id}"'
+        headers = {
+            "ETag": etag,
+            "Last-Modified": formatdate(meme.mtime, usegmt=True),
+            "Cache-Control": cache_control,
+            "Accept-Ranges": "bytes",
+            "X-Meme-Id": meme.meme_id,
+        }
+        if _not_modified(request, etag, meme.mtime):
+            return Response(status_code=304, headers=headers)
+
+        media_type = content_type(meme)
+        status_code, start, end = 200, 0, meme.size - 1
+        range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        if range_header and meme.size and (if_range is None or if_range == etag):
+            try:
+                selected = _parse_range(range_header, meme.size)
+            except ValueError:
+                headers["Content-Range"] = f"bytes */{meme.size}"
+                return Response(status_code=416, headers=headers)
+            if selected is not None:
+                status_code, (start, end) = 206, selected
+                headers["Content-Range"] = f"bytes {start}-{end}/{meme.size}"
+
+        data = await self.read(meme)
+        if data is not None:
+            return Response(
+                data[start : end + 1],
+                status_code=status_code,
+                media_type=media_type,
+                headers=headers,
+            )
+        headers["Content-Length"] = str(max(0, end - start + 1))
+        return StreamingResponse(
+            _iter_file(meme, start, end),
+            status_code=status_code,
+            media_type=media_type,
+            headers=headers,
+        )
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Предрендер мемов в нескольких разрешениях (thumb/medium/full).
+
+Варианты лежат рядом с датасетом в ``<base>/.variants/<size>/<emotion>/``
+и называются по meme_id исходника (путь и размер), поэтому новый файл или
+файл нового размера получает новый вариант, а остальные не пересобираются.
+Заменённый файл того же размера нужно переименовать: иначе останутся
+старые варианты и закэшированные клиентами байты. meme_id не зависит от
+того, как записан base_dir, так что сборка с абсолютным и относительным
+путём даёт одни и те же имена.
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image
+
+from emotion_recognition import MemeFile, MemeStore
+
+logger = logging.getLogger("emotion_api.variants")
+
+VARIANT_SIZES: Dict[str, Optional[int]] = {"thumb": 160, "medium": 480, "full": None}
+VARIANT_DIR = ".variants"
+FORMATS = {"webp": "WEBP", "jpeg": "JPEG"}
+
+Targets = List[Tuple[Path, Optional[int]]]
+Job = Tuple[Path, Targets, str, int]
+
+
+def variant_path(base_path: Path, meme: MemeFile, size: str, fmt: str = "webp") -> Path:
+    return base_path / VARIANT_DIR / size / meme.path.parent.name / f"{meme.meme_id}.{fmt}"
+
+
+def _render(source: Path, targets: Targets, fmt: str, quality: int) -> int:
+    with Image.open(source) as image:
+        largest = max((side for _, side in targets if side), default=None)
+        if largest and all(side for _, side in targets):
+            image.draft("RGB", (largest, largest))
+        keep_alpha = fmt == "webp" and image.mode in ("RGBA", "LA", "P")
+        image = image.convert("RGBA" if keep_alpha else "RGB")
+        for target, side in targets:
+            variant = image.copy()
+            if side:
+                variant.thumbnail((side, side), Image.LANCZOS)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp = target.with_suffix(target.suffix + ".tmp")
+            variant.save(tmp, FORMATS[fmt], quality=quality, optimize=True)
+            os.replace(tmp, target)
+    return len(targets)
+
+
+def _render_job(job: Job) -> Tuple[Path, Optional[str]]:
+    source, targets, fmt, quality = job
+    try:
+        _render(source, targets, fmt, quality)
+        return source, None
+    except Exception as exc:
+        return source, str(exc)
+
+
+def _plan(store: MemeStore, fmt: str, quality: int) -> Iterable[Job]:
+    for emotion in store.list_emotions():
+        for meme in store.files(emotion):
+            targets = [
+                (variant_path(store.base_path, meme, size, fmt), side)
+                for size, side in VARIANT_SIZES.items()
+            ]
+            missing = [(path, side) for path, side in targets if not path.exists()]
+            if missing:
+                yield meme.path, missing, fmt, quality
+
+
+def _prune(store: MemeStore, fmt: str) -> int:
+    """Удаляет варианты этого формата, чьих исходников больше нет."""
+    root = store.base_path / VARIANT_DIR
+    if not root.exists():
+        return 0
+    # Сравниваются пути относительно .variants, а варианты других форматов
+    # не трогаются: их может отдавать API с другим EMOTION_MEME_VARIANT_FORMAT.
+    alive = {
+        variant_path(store.base_path, meme, size, fmt).relative_to(root)
+        for emotion in store.list_emotions()
+        for meme in store.files(emotion)
+        for size in VARIANT_SIZES
+    }
+    removed = 0
+    for path in root.rglob(f"*.{fmt}"):
+        if path.is_file() and path.relative_to(root) not in alive:
+            path.unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+
+def build_variants(
+    base_dir: str = "memes", fmt: str = "webp", quality: int = 80, workers: int | None = None
+) -> Dict[str, int]:
+    store = MemeStore(base_dir)
+    store.refresh()
+    jobs = list(_plan(store, fmt, quality))
+    failed = 0
+    started = time.perf_counter()
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for source, error in executor.map(_render_job, jobs, chunksize=8):
+                if error:
+                    failed += 1
+                    logger.warning("Variant build failed for %s: %s", source, error)
+    removed = _prune(store, fmt)
+    stats = {"rendered": len(jobs) - failed, "failed": failed, "pruned": removed}
+    logger.info("Variants built in %.1fs: %s", time.perf_counter() - started, stats)
+    return stats
+
+
+class MemeVariants:
+    """Находит готовый вариант мема для отдачи, иначе возвращает оригинал.
+
+    Найденные варианты кэшируются (LRU на ``max_entries``) и не реже раза
+    в ``refresh_interval`` секунд перепроверяются: удалённый файл
+    вытесняется, и отдаётся оригинал.
+    """
+
+    def __init__(
+        self,
+        base_path: Path,
+        fmt: str | None = None,
+        max_entries: int | None = None,
+        refresh_interval: float | None = None,
+    ) -> None:
+        self.base_path = base_path
+        self.fmt = fmt or os.getenv("EMOTION_MEME_VARIANT_FORMAT", "webp")
+        if max_entries is None:
+            max_entries = int(os.getenv("EMOTION_MEME_VARIANT_CACHE", "4096"))
+        if refresh_interval is None:
+            refresh_interval = float(os.getenv("EMOTION_MEME_REFRESH", "5"))
+        self.max_entries = max_entries
+        self.refresh_interval = refresh_interval
+        self._resolved: "OrderedDict[Tuple[str, str], Tuple[MemeFile, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, meme: MemeFile, size: str) -> MemeFile | None:
+        path = variant_path(self.base_path, meme, size, self.fmt)
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        return MemeFile(path, stat.st_size, stat.st_mtime, f"{meme.meme_id}-{size}-{self.fmt}")
+
+    def resolve(self, meme: MemeFile, size: str | None) -> MemeFile:
+        if not size or size not in VARIANT_SIZES:
+            return meme
+        key = (meme.meme_id, size)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._resolved.get(key)
+            if cached is not None:
+                self._resolved.move_to_end(key)
+        if cached is not None and now - cached[1] < self.refresh_interval:
+            return cached[0]
+        variant = self._lookup(meme, size)
+        with self._lock:
+            if variant is None:
+                self._resolved.pop(key, None)
+                return meme
+            self._resolved[key] = (variant, now)
+            self._resolved.move_to_end(key)
+            while len(self._resolved) > self.max_entries:
+                self._resolved.popitem(last=False)
+        return variant
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build resized meme variants")
+    parser.add_argument("--base-dir", default="memes")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="webp")
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    stats = build_variants(args.base_dir, args.format, args.quality, args.workers)
+    print(stats)
+    sys.exit(1 if stats["failed"] else 0)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    main()
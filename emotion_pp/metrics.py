@@ -0,0 +1,315 @@
+"""
+Метрики API в текстовом формате Prometheus, без внешних зависимостей.
+
+В префорке (prefork.py) у каждого воркера свой реестр; воркеры
+выгружают его в общий каталог EMOTION_METRICS_DIR, и /metrics любого
+воркера отдаёт сумму по всем, как multiprocess-режим prometheus_client.
+"""
+
+from __future__ import annotations
+
+import bisect
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+Dump = List[list]
+
+PUBLISH_INTERVAL = 1.0
+
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+SIZE_BUCKETS = tuple(1024 * 4**power for power in range(10))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {sorted(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def dump(self) -> Dump:
+        """Сырые значения для сложения с другими процессами."""
+        raise NotImplementedError
+
+    def samples(self, others: Sequence[Dump] = ()) -> List[str]:
+        raise NotImplementedError
+
+    def render(self, others: Sequence[Dump] = ()) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self.samples(others),
+        ]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: object) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dump(self) -> Dump:
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def totals(self, others: Sequence[Dump] = ()) -> Dict[LabelValues, float]:
+        """Значения по меткам вместе с выгрузками других процессов."""
+        with self._lock:
+            values = dict(self._values)
+        for dump in others:
+            for key, value in dump:
+                key = tuple(key)
+                values[key] = values.get(key, 0.0) + value
+        return values
+
+    def samples(self, others: Sequence[Dump] = ()) -> List[str]:
+        values = self.totals(others)
+        return [
+            f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels: object) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: object) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Счётчики по бакетам без накопления: сумма считается при выводе.
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[index] += 1
+            self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels: object) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def dump(self) -> Dump:
+        with self._lock:
+            return [[list(key), list(counts), self._sums[key]] for key, counts in self._counts.items()]
+
+    def samples(self, others: Sequence[Dump] = ()) -> List[str]:
+        with self._lock:
+            merged = {key: (list(counts), self._sums[key]) for key, counts in self._counts.items()}
+        for dump in others:
+            for key, counts, total in dump:
+                key = tuple(key)
+                if len(counts) != len(self.buckets) + 1:
+                    continue
+                previous, previous_total = merged.get(key, ([0] * len(counts), 0.0))
+                merged[key] = ([a + b for a, b in zip(previous, counts)], previous_total + total)
+        series = sorted((key, counts, total) for key, (counts, total) in merged.items())
+        lines: List[str] = []
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def dump(self) -> Dict[str, Dump]:
+        return {metric.name: metric.dump() for metric in self._metrics}
+
+    def render(self, others: Sequence[Dict[str, Dump]] = ()) -> str:
+        """Текст для /metrics; ``others`` — выгрузки других процессов."""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render([other.get(metric.name, []) for other in others]))
+        return "\n".join(lines) + "\n"
+
+
+class SharedState:
+    """Метрики и готовность воркеров префорка в общем каталоге.
+
+    Каждый воркер атомарно пишет ``<pid>.json``; файлы вышедших воркеров
+    удаляет супервизор. ``expected`` — сколько воркеров должно быть.
+    """
+
+    def __init__(self, directory: Path, expected: int = 0) -> None:
+        self.directory = directory
+        self.expected = expected
+
+    @classmethod
+    def from_env(cls) -> Optional["SharedState"]:
+        directory = os.getenv("EMOTION_METRICS_DIR")
+        if not directory:
+            return None
+        return cls(Path(directory), int(os.getenv("EMOTION_PREFORK_WORKERS", "0")))
+
+    def _path(self, pid: int) -> Path:
+        return self.directory / f"{pid}.json"
+
+    def publish(self, registry: Registry, **extra: Any) -> None:
+        target = self._path(os.getpid())
+        tmp = target.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"pid": os.getpid(), "metrics": registry.dump(), **extra}))
+        os.replace(tmp, target)
+
+    def others(self) -> List[Dict[str, Any]]:
+        """Последние выгрузки остальных воркеров."""
+        own = f"{os.getpid()}.json"
+        states = []
+        for path in self.directory.glob("*.json"):
+            if path.name == own:
+                continue
+            try:
+                states.append(json.loads(path.read_text()))
+            except (OSError, ValueError):
+                continue  # воркер как раз вышел
+        return states
+
+    def remove(self, pid: int) -> None:
+        self._path(pid).unlink(missing_ok=True)
+        self._path(pid).with_suffix(".tmp").unlink(missing_ok=True)
+
+
+registry = Registry()
+
+stage_seconds: Histogram = registry.register(
+    Histogram("emotion_stage_seconds", "Latency of a pipeline stage.", ("stage",))
+)
+request_seconds: Histogram = registry.register(
+    Histogram("emotion_request_seconds", "HTTP request latency.", ("endpoint",))
+)
+requests_total: Counter = registry.register(
+    Counter(
+        "emotion_requests_total",
+        "HTTP requests by endpoint, analysis mode and status.",
+        ("endpoint", "mode", "status"),
+    )
+)
+requests_in_flight: Gauge = registry.register(
+    Gauge("emotion_requests_in_flight", "HTTP requests currently being served.")
+)
+payload_bytes: Histogram = registry.register(
+    Histogram("emotion_payload_bytes", "Size of uploaded images.", buckets=SIZE_BUCKETS)
+)
+dominant_emotions: Counter = registry.register(
+    Counter("emotion_dominant_total", "Classified images by dominant emotion.", ("emotion",))
+)
+cache_lookups: Counter = registry.register(
+    Counter("emotion_cache_lookups_total", "Result cache lookups by outcome.", ("result",))
+)
+
+
+def observe_stages(timings: Dict[str, float]) -> None:
+    for stage, seconds in timings.items():
+        stage_seconds.observe(seconds, stage=stage)
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: число, длительность и статусы HTTP-запросов.
+
+    ``labels`` по ASGI scope возвращает пару (endpoint, mode); endpoint
+    должен быть шаблоном маршрута, а не сырым путём, чтобы не плодить серии.
+    """
+
+    def __init__(self, app: Any, labels: Callable[[Dict[str, Any]], Tuple[str, str]]) -> None:
+        self.app = app
+        self.labels = labels
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        requests_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            requests_in_flight.dec()
+            endpoint, mode = self.labels(scope)
+            request_seconds.observe(time.perf_counter() - started, endpoint=endpoint)
+            requests_total.inc(endpoint=endpoint, mode=mode, status=status)
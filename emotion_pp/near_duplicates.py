@@ -0,0 +1,129 @@
+"""
+Поиск почти-дубликатов кадров по перцептивному хэшу (dHash + BK-дерево).
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Container, Dict, Hashable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+def dhash(frame: np.ndarray, size: int = 8) -> int:
+    gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(left: int, right: int) -> int:
+    return bin(left ^ right).count("1")
+
+
+class BKTree:
+    """BK-дерево по метрике Хэмминга; узел — [hash, {distance: child}]."""
+
+    def __init__(self) -> None:
+        self._root: Optional[List[Any]] = None
+
+    def add(self, value: int) -> None:
+        if self._root is None:
+            self._root = [value, {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = [value, {}]
+                return
+            node = child
+
+    def nearest(
+        self, value: int, max_distance: int, alive: Optional[Container[int]] = None
+    ) -> Optional[Tuple[int, int]]:
+        if self._root is None:
+            return None
+        best: Optional[Tuple[int, int]] = None
+        radius = max_distance
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius and (alive is None or node[0] in alive):
+                best, radius = (node[0], distance), distance
+                if distance == 0:
+                    break
+            for edge, child in node[1].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return best
+
+
+class NearDuplicateIndex:
+    """Ограниченный по размеру индекс «хэш кадра → результат анализа».
+
+    При переполнении вытесняется самая старая запись крупнейшей группы;
+    дерево группы перестраивается, когда вытесненных хэшей в нём больше,
+    чем живых.
+    """
+
+    def __init__(self, max_distance: int = 6, capacity: int = 5000) -> None:
+        self.max_distance = max_distance
+        self.capacity = capacity
+        self._entries: Dict[Hashable, "OrderedDict[int, Dict[str, Any]]"] = {}
+        self._trees: Dict[Hashable, BKTree] = {}
+        self._stale: Dict[Hashable, int] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional["NearDuplicateIndex"]:
+        distance = os.getenv("EMOTION_NEAR_DUP_DISTANCE")
+        if distance is None or int(distance) < 0:
+            return None
+        return cls(
+            max_distance=int(distance),
+            capacity=int(os.getenv("EMOTION_NEAR_DUP_CAPACITY", "5000")),
+        )
+
+    def lookup(self, scope: Hashable, value: int) -> Optional[Tuple[Dict[str, Any], int]]:
+        with self._lock:
+            entries = self._entries.get(scope)
+            if not entries:
+                return None
+            match = self._trees[scope].nearest(value, self.max_distance, alive=entries)
+            if match is None:
+                return None
+            return entries[match[0]], match[1]
+
+    def add(self, scope: Hashable, value: int, result: Dict[str, Any]) -> None:
+        with self._lock:
+            entries = self._entries.setdefault(scope, OrderedDict())
+            if value in entries:
+                entries.move_to_end(value)
+            else:
+                self._trees.setdefault(scope, BKTree()).add(value)
+                self._size += 1
+            entries[value] = result
+            while self._size > self.capacity:
+                self._evict_oldest()
+
+    def _evict_oldest(self) -> None:
+        scope = max(self._entries, key=lambda name: len(self._entries[name]))
+        entries = self._entries[scope]
+        entries.popitem(last=False)
+        self._size -= 1
+        self._stale[scope] = self._stale.get(scope, 0) + 1
+        if self._stale[scope] > len(entries):
+            tree = BKTree()
+            for value in entries:
+                tree.add(value)
+            self._trees[scope] = tree
+            self._stale[scope] = 0
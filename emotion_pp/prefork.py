@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Продовый запуск API: родитель готовит общий сокет и форкает N воркеров.
+
+Родитель заранее импортирует API, TensorFlow и DeepFace и прочитывает
+файлы весов, не запуская рантайм TensorFlow: страницы модулей и page cache
+с весами делятся между воркерами copy-on-write. Граф и тензоры модели
+строятся уже в воркере, потому что поднятый рантайм TF не переживает fork.
+
+Каждый воркер получает свои intra-op/inter-op потоки TF, потоки OpenCV и,
+если ядер хватает, закреплённый набор CPU. По умолчанию воркеров столько
+же, сколько доступных ядер, по одному потоку на воркер: маленькая CNN на
+одиночных кадрах плохо масштабируется внутри операции, и независимые
+однопоточные процессы дают наибольшую пропускную способность на узел.
+Больше потоков на воркер (``EMOTION_WORKER_THREADS``) уменьшают задержку
+одного запроса ценой пропускной способности и памяти.
+
+Но каждый воркер держит свой рантайм TF: с TF 2.15 CPU в режиме direct
+прогретый воркер занимает ~300 МБ RSS, из них ~150 МБ собственных (PSS),
+детекторы DeepFace кроме opencv добавляют ещё. Поэтому число воркеров по
+умолчанию ограничено и доступной памятью (лимит cgroup или MemAvailable),
+из расчёта ``EMOTION_WORKER_MEMORY_MB`` на воркер.
+
+Метрики и готовность воркеров сводятся через общий каталог
+(EMOTION_METRICS_DIR, по умолчанию временный): /metrics отдаёт сумму по
+всем воркерам, а /health/ready готов, только когда готовы все.
+
+Переменные: EMOTION_WORKERS, EMOTION_WORKER_THREADS, EMOTION_WORKER_MEMORY_MB,
+EMOTION_WORKER_INTER_OP_THREADS, EMOTION_WORKER_AFFINITY, EMOTION_PREFORK_PRELOAD,
+EMOTION_METRICS_DIR.
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from metrics import SharedState
+
+logger = logging.getLogger("emotion_api.prefork")
+
+RESTART_BACKOFF = 1.0
+SHUTDOWN_TIMEOUT = 30.0
+
+
+def _available_cpus() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _available_memory_mb() -> Optional[int]:
+    """Лимит памяти cgroup v2 или MemAvailable; None, если неизвестно."""
+    try:
+        limit = Path("/sys/fs/cgroup/memory.max").read_text().strip()
+        if limit.isdigit():
+            return int(limit) // 2**20
+    except OSError:
+        pass
+    try:
+        for line in Path("/proc/meminfo").read_text().splitlines():
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) // 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() not in ("0", "false", "no", "off")
+
+
+@dataclass
+class PreforkConfig:
+    host: str = "0.0.0.0"
+    port: int = 8000
+    threads: int = 1
+    inter_op_threads: int = 1
+    workers: int = 0
+    affinity: bool = True
+    preload: bool = True
+    worker_memory_mb: int = 400
+    cpus: List[int] = field(default_factory=_available_cpus)
+    memory_mb: Optional[int] = field(default_factory=_available_memory_mb)
+
+    def __post_init__(self) -> None:
+        self.threads = max(1, self.threads)
+        self.inter_op_threads = max(1, self.inter_op_threads)
+        if self.workers <= 0:
+            self.workers = max(1, len(self.cpus) // self.threads)
+            if self.memory_mb and self.worker_memory_mb > 0:
+                fits = max(1, self.memory_mb // self.worker_memory_mb)
+                if fits < self.workers:
+                    logger.warning(
+                        "Only %d MB of memory for %d workers, starting %d; set EMOTION_WORKERS to override",
+                        self.memory_mb,
+                        self.workers,
+                        fits,
+                    )
+                    self.workers = fits
+
+    @classmethod
+    def from_env(cls) -> "PreforkConfig":
+        return cls(
+            host=os.getenv("EMOTION_API_HOST", "0.0.0.0"),
+            port=int(os.getenv("EMOTION_API_PORT", "8000")),
+            threads=int(os.getenv("EMOTION_WORKER_THREADS", "1")),
+            inter_op_threads=int(os.getenv("EMOTION_WORKER_INTER_OP_THREADS", "1")),
+            workers=int(os.getenv("EMOTION_WORKERS", "0")),
+            affinity=_env_flag("EMOTION_WORKER_AFFINITY", "1"),
+            preload=_env_flag("EMOTION_PREFORK_PRELOAD", "1"),
+            worker_memory_mb=int(os.getenv("EMOTION_WORKER_MEMORY_MB", "400")),
+        )
+
+    def worker_cpus(self, index: int) -> Optional[List[int]]:
+        """Ядра воркера или None, если на всех воркеров их не хватает."""
+        if not self.affinity or self.workers * self.threads > len(self.cpus):
+            return None
+        return self.cpus[index * self.threads : (index + 1) * self.threads]
+
+
+def thread_env(threads: int, inter_op_threads: int = 1) -> Dict[str, str]:
+    """Переменные окружения, ограничивающие потоки TF, ORT и BLAS процесса."""
+    intra = str(threads)
+    return {
+        "TF_NUM_INTRAOP_THREADS": intra,
+        "TF_NUM_INTEROP_THREADS": str(inter_op_threads),
+        "EMOTION_INFERENCE_THREADS": intra,
+        "OMP_NUM_THREADS": intra,
+        "OPENBLAS_NUM_THREADS": intra,
+        "MKL_NUM_THREADS": intra,
+    }
+
+
+def _preload(config: PreforkConfig):
+    """Импорты и чтение весов в родителе; рантайм TF здесь не стартует."""
+    started = time.perf_counter()
+    # Процессный пул внутри воркера не нужен: параллелизм дают сами воркеры.
+    os.environ["EMOTION_POOL_MODE"] = "thread"
+    os.environ.setdefault("EMOTION_POOL_WORKERS", str(config.threads + 1))
+    # Переменные задаются до импорта TF, чтобы и родитель не поднимал
+    # лишних пулов потоков, если что-то всё же создаст контекст.
+    for name, value in thread_env(config.threads, config.inter_op_threads).items():
+        os.environ.setdefault(name, value)
+
+    import run_api
+
+    if config.preload:
+        import tensorflow  # noqa: F401
+        import deepface.DeepFace  # noqa: F401
+
+        from emotion_model import EXPORTED_FORMATS, exported_model_path
+        from emotion_recognition import EmotionRecognizer, _weights_dir
+
+        paths = [_weights_dir() / spec.filename for spec in EmotionRecognizer._weights]
+        mode = os.getenv("EMOTION_INFERENCE_MODE", "direct").lower()
+        if mode in EXPORTED_FORMATS:
+            paths.append(
+                Path(os.getenv("EMOTION_MODEL_PATH") or exported_model_path(_weights_dir(), mode))
+            )
+        for path in paths:
+            if path.exists():
+                with path.open("rb") as handle:
+                    while handle.read(1 << 20):
+                        pass
+    logger.info("Parent preloaded in %.2fs", time.perf_counter() - started)
+    return run_api.app
+
+
+def _bind(config: PreforkConfig) -> socket.socket:
+    family = socket.AF_INET6 if ":" in config.host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((config.host, config.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _configure_worker(config: PreforkConfig, index: int) -> None:
+    cpus = config.worker_cpus(index)
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    import cv2
+
+    cv2.setNumThreads(config.threads)
+    tf = sys.modules.get("tensorflow")
+    if tf is not None:
+        tf.config.threading.set_intra_op_parallelism_threads(config.threads)
+        tf.config.threading.set_inter_op_parallelism_threads(config.inter_op_threads)
+    logger.info(
+        "Worker %d (pid %d): %d intra-op / %d inter-op threads, cpus %s",
+        index,
+        os.getpid(),
+        config.threads,
+        config.inter_op_threads,
+        cpus or "any",
+    )
+
+
+def _run_worker(app, sock: socket.socket, config: PreforkConfig, index: int) -> None:
+    import uvicorn
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    _configure_worker(config, index)
+    server = uvicorn.Server(uvicorn.Config(app, log_config=None, access_log=False))
+    server.run(sockets=[sock])
+
+
+def _shared_state(config: PreforkConfig) -> SharedState:
+    """Каталог для метрик воркеров; задаётся в окружении до импорта run_api."""
+    configured = os.getenv("EMOTION_METRICS_DIR")
+    if configured:
+        directory = Path(configured)
+        directory.mkdir(parents=True, exist_ok=True)
+        # Выгрузки прошлого запуска сложились бы с текущими.
+        for stale in directory.glob("*.json"):
+            stale.unlink(missing_ok=True)
+    else:
+        directory = Path(tempfile.mkdtemp(prefix="emotion-metrics-"))
+    os.environ["EMOTION_METRICS_DIR"] = str(directory)
+    os.environ["EMOTION_PREFORK_WORKERS"] = str(config.workers)
+    return SharedState(directory, config.workers)
+
+
+class Supervisor:
+    """Держит N воркеров живыми и останавливает их по SIGTERM/SIGINT."""
+
+    def __init__(
+        self, app, sock: socket.socket, config: PreforkConfig, shared: Optional[SharedState] = None
+    ) -> None:
+        self.app = app
+        self.sock = sock
+        self.config = config
+        self.shared = shared
+        self.children: Dict[int, int] = {}
+        self.stopping = False
+        self.deadline = math.inf
+
+    def spawn(self, index: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(self.app, self.sock, self.config, index)
+            except BaseException:
+                logger.exception("Worker %d crashed", index)
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = index
+
+    def stop(self, *_: object) -> None:
+        if not self.stopping:
+            self.stopping = True
+            self.deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        self._signal_all(signal.SIGTERM)
+
+    def _signal_all(self, signum: int) -> None:
+        for pid in self.children:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.config.workers):
+            self.spawn(index)
+        logger.info(
+            "Serving on %s:%d with %d workers", self.config.host, self.config.port, self.config.workers
+        )
+        while self.children:
+            # Опрос вместо блокирующего os.wait: при остановке нужно
+            # добить зависшие воркеры по таймауту.
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                if self.stopping and time.monotonic() > self.deadline:
+                    logger.warning("Killing %d workers after shutdown timeout", len(self.children))
+                    self._signal_all(signal.SIGKILL)
+                    self.deadline = math.inf
+                time.sleep(0.2)
+                continue
+            index = self.children.pop(pid, None)
+            if self.shared is not None:
+                self.shared.remove(pid)
+            if index is None or self.stopping:
+                continue
+            logger.warning(
+                "Worker %d (pid %d) exited with %d, restarting",
+                index,
+                pid,
+                os.waitstatus_to_exitcode(status),
+            )
+            time.sleep(RESTART_BACKOFF)
+            if not self.stopping:
+                self.spawn(index)
+
+
+def main() -> None:
+    if not hasattr(os, "fork"):
+        logger.warning("fork is not available, falling back to a single process")
+        import run_api
+
+        run_api.main()
+        return
+    config = PreforkConfig.from_env()
+    created = not os.getenv("EMOTION_METRICS_DIR")
+    shared = _shared_state(config)
+    sock = _bind(config)
+    try:
+        app = _preload(config)
+        Supervisor(app, sock, config, shared).run()
+    finally:
+        sock.close()
+        if created:
+            shutil.rmtree(shared.directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    main()
@@ -0,0 +1,150 @@
+"""
+Кэш результатов распознавания по содержимому запроса.
+
+Хранится в SQLite (WAL), поэтому один файл разделяют все воркеры uvicorn
+на узле: попадание в одном процессе экономит инференс во всех остальных.
+Чтение не берёт блокировку записи: счётчики попаданий живут в метриках
+процесса, а отметка для LRU пишется не чаще раза в ``touch_interval``.
+Ошибки SQLite логируются и считаются промахом — запрос уходит в инференс.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence
+
+import metrics
+
+logger = logging.getLogger("emotion_api.cache")
+
+BUSY_TIMEOUT_MS = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at);
+CREATE INDEX IF NOT EXISTS results_created_at ON results (created_at);
+"""
+
+
+class ResultCache:
+    def __init__(
+        self,
+        path: str | Path,
+        max_entries: int = 10000,
+        ttl: float = 86400.0,
+        touch_interval: float = 60.0,
+    ) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @classmethod
+    def from_env(cls) -> Optional["ResultCache"]:
+        max_entries = int(os.getenv("EMOTION_CACHE_MAX_ENTRIES", "10000"))
+        if max_entries <= 0:
+            return None
+        return cls(
+            os.getenv("EMOTION_CACHE_PATH", ".cache/emotion_results.sqlite3"),
+            max_entries=max_entries,
+            ttl=float(os.getenv("EMOTION_CACHE_TTL", "86400")),
+            touch_interval=float(os.getenv("EMOTION_CACHE_TOUCH_INTERVAL", "60")),
+        )
+
+    @staticmethod
+    def key(payload: bytes, detect_face: bool, detector_backend: str, model_version: str) -> str:
+        digest = hashlib.sha256(payload)
+        digest.update(f"|{int(detect_face)}|{detector_backend}|{model_version}".encode())
+        return digest.hexdigest()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _touch(self, conn: sqlite3.Connection, key: str, now: float) -> None:
+        # Отметка для LRU необязательна: если запись занята, не ждём её.
+        conn.execute("PRAGMA busy_timeout = 0")
+        try:
+            conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+        except sqlite3.OperationalError:
+            pass
+        finally:
+            conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, created_at, accessed_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            # Просроченные записи удаляет put, чтение ничего не пишет.
+            if row is None or now - row[1] > self.ttl:
+                metrics.cache_lookups.inc(result="miss")
+                return None
+            if now - row[2] > self.touch_interval:
+                self._touch(conn, key, now)
+            value = json.loads(row[0])
+        except sqlite3.Error as exc:
+            logger.warning("Result cache lookup failed: %s", exc)
+            metrics.cache_lookups.inc(result="error")
+            return None
+        metrics.cache_lookups.inc(result="hit")
+        return value
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        now = time.time()
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(
+                    "INSERT OR REPLACE INTO results (key, value, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), now, now),
+                )
+                conn.execute("DELETE FROM results WHERE created_at < ?", (now - self.ttl,))
+                conn.execute(
+                    "DELETE FROM results WHERE key IN ("
+                    "SELECT key FROM results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+        except sqlite3.Error as exc:
+            logger.warning("Result cache store skipped: %s", exc)
+
+    def stats(self, others: Sequence[metrics.Dump] = ()) -> Dict[str, Any]:
+        """Размер кэша и попадания; ``others`` — выгрузки счётчика других воркеров."""
+        conn = self._connect()
+        entries = conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        lookups = {key[0]: value for key, value in metrics.cache_lookups.totals(others).items()}
+        hits = int(lookups.get("hit", 0))
+        misses = int(lookups.get("miss", 0) + lookups.get("error", 0))
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        }
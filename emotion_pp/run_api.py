@@ -5,7 +5,9 @@ FastAPI сервер для Emotion→Meme.
 
 from __future__ import annotations
 
+import asyncio
 import base64
+import json
 import logging
 import os
 import platform
@@ -13,21 +15,131 @@ import random
 import socket
 import subprocess
 import sys
+import tarfile
+import tempfile
+import time
+import uuid
+import zipfile
+import zlib
+from contextlib import asynccontextmanager, contextmanager
 from pathlib import Path
+from typing import AsyncIterator, Awaitable, Iterator, List, Optional, Tuple, TypeVar
+
+_IMPORT_STARTED = time.perf_counter()
 
 import uvicorn
-from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi import FastAPI, File, HTTPException, Request, UploadFile, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.datastructures import QueryParams
+from starlette.routing import Match
 
-from emotion_recognition import EMOTIONS, memes, recognizer
+from emotion_recognition import (
+    DEFAULT_DETECTOR_BACKEND,
+    DETECTOR_BACKENDS,
+    EMOTIONS,
+    ImageTooLarge,
+    MemeFile,
+    memes,
+    model_version,
+)
+import metrics
+import tracing
+from inference_pool import InferencePool, PoolSaturated
+from live_stream import run_session
+from meme_delivery import FALLBACK, IMMUTABLE, MemeDelivery, content_type
+from meme_variants import VARIANT_SIZES, MemeVariants
+from result_cache import ResultCache
+from video_timeline import (
+    VIDEO_SUFFIXES,
+    SampledFrame,
+    Sampling,
+    VideoFrames,
+    batched,
+    timeline_entry,
+)
 
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
 )
 logger = logging.getLogger("emotion_api")
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
+
+pool = InferencePool.from_env()
+cache = ResultCache.from_env()
+delivery = MemeDelivery()
+variants = MemeVariants(memes.base_path)
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp"}
+BATCH_MAX_ITEMS = int(os.getenv("EMOTION_BATCH_MAX_ITEMS", "1000"))
+BATCH_MAX_ITEM_BYTES = int(os.getenv("EMOTION_BATCH_MAX_ITEM_MB", "20")) * 1024 * 1024
+BATCH_MAX_TOTAL_BYTES = int(os.getenv("EMOTION_BATCH_MAX_TOTAL_MB", "500")) * 1024 * 1024
+WS_MAX_FPS = float(os.getenv("EMOTION_WS_MAX_FPS", "15"))
+WS_MAX_IN_FLIGHT = int(os.getenv("EMOTION_WS_MAX_IN_FLIGHT", "1"))
+VIDEO_MAX_BYTES = int(os.getenv("EMOTION_VIDEO_MAX_MB", "200")) * 1024 * 1024
+VIDEO_MAX_SIDE = int(os.getenv("EMOTION_VIDEO_MAX_SIDE", "640"))
+VIDEO_BATCH_SIZE = int(os.getenv("EMOTION_VIDEO_BATCH_SIZE", "8"))
+# По умолчанию доступен только основной детектор: каждый дополнительный
+# загружает свои веса в каждый воркер, поэтому их включают явно.
+ALLOWED_DETECTORS = [DEFAULT_DETECTOR_BACKEND] + [
+    name.strip()
+    for name in os.getenv("EMOTION_DETECTOR_BACKENDS", "").split(",")
+    if name.strip() in DETECTOR_BACKENDS and name.strip() != DEFAULT_DETECTOR_BACKEND
+]
+
+MODEL_VERSION = model_version()
+# В префорке: общий каталог, через который воркеры делятся метриками и готовностью.
+shared = metrics.SharedState.from_env()
+
+T = TypeVar("T")
+
+
+async def _report_warmup() -> None:
+    started = time.perf_counter()
+    state = await pool.wait_ready()
+    if state == "ready":
+        logger.info(
+            "Model ready in %.2fs: %s", time.perf_counter() - started, pool.load_report()
+        )
+    else:
+        logger.error("Model failed to load: %s", pool.load_error)
+
+
+async def _publish_state() -> None:
+    while True:
+        await asyncio.to_thread(
+            shared.publish, metrics.registry, status=pool.state, error=pool.load_error
+        )
+        await asyncio.sleep(metrics.PUBLISH_INTERVAL)
 
-app = FastAPI(title="Emotion→Meme API", version="1.0.0")
+
+async def _refresh_memes() -> None:
+    while True:
+        await asyncio.to_thread(memes.refresh)
+        await asyncio.sleep(max(memes.refresh_interval, 1.0))
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    logger.info("API modules imported in %.2fs", IMPORT_SECONDS)
+    pool.start()
+    logger.info("Inference pool started, loading model in background: %s", pool.stats())
+    tasks = [asyncio.create_task(_report_warmup()), asyncio.create_task(_refresh_memes())]
+    if shared is not None:
+        tasks.append(asyncio.create_task(_publish_state()))
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        if shared is not None:
+            shared.remove(os.getpid())
+        pool.shutdown()
+
+
+app = FastAPI(title="Emotion→Meme API", version="1.0.0", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -37,28 +149,489 @@ app.add_middleware(
 )
 
 
-def _classify_payload(payload: bytes, detect_face: bool) -> dict:
-    analysis = recognizer.analyze(payload, detect_face=detect_face)
+def _request_labels(scope: dict) -> Tuple[str, str]:
+    endpoint = "unmatched"
+    for route in app.router.routes:
+        if route.matches(scope)[0] == Match.FULL:
+            endpoint = route.path
+            break
+    mode = "none"
+    if endpoint == "/classify/faces":
+        mode = "faces"
+    elif endpoint.startswith("/classify"):
+        detect_face = QueryParams(scope.get("query_string", b"")).get("detect_face", "true")
+        mode = "meme" if detect_face.lower() in ("false", "0", "no", "off") else "face"
+    return endpoint, mode
+
+
+app.add_middleware(metrics.MetricsMiddleware, labels=_request_labels)
+if tracing.tracer.enabled:
+    app.add_middleware(tracing.TracingMiddleware, tracer=tracing.tracer)
+
+
+@app.exception_handler(ImageTooLarge)
+async def image_too_large(_: Request, exc: ImageTooLarge) -> JSONResponse:
+    return JSONResponse({"detail": str(exc)}, status_code=413)
+
+
+@contextmanager
+def _stage(name: str) -> Iterator[None]:
+    with tracing.span(name), metrics.stage_seconds.time(stage=name):
+        yield
+
+
+async def _read_upload(file: UploadFile) -> bytes:
+    with _stage("upload_read"):
+        payload = await file.read()
+    metrics.payload_bytes.observe(len(payload))
+    if not payload:
+        raise HTTPException(status_code=400, detail="Empty payload")
+    return payload
+
+
+def _require_ready() -> None:
+    if not pool.ready:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Model is {pool.state}",
+            headers={"Retry-After": "5"},
+        )
+
+
+async def _run_inference(call: Awaitable[T]) -> T:
+    try:
+        _require_ready()
+    except HTTPException:
+        call.close()
+        raise
+    try:
+        with tracing.span("inference"):
+            result = await call
+            tracing.attach(result.pop("trace", None))
+    except PoolSaturated:
+        raise HTTPException(
+            status_code=503,
+            detail="Inference pool is busy",
+            headers={"Retry-After": "1"},
+        )
+    metrics.observe_stages(result.pop("timings", {}))
+    return result
+
+
+def _resolve_detector(detector_backend: str | None) -> str:
+    if not detector_backend:
+        return DEFAULT_DETECTOR_BACKEND
+    if detector_backend not in ALLOWED_DETECTORS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Unknown detector backend, expected one of {ALLOWED_DETECTORS}",
+        )
+    return detector_backend
+
+
+async def _analyze_payload(
+    payload: bytes,
+    detect_face: bool,
+    wait: bool,
+    session_id: str | None,
+    detector_backend: str,
+) -> dict:
+    return await _run_inference(
+        pool.analyze(
+            payload,
+            detect_face,
+            wait=wait,
+            session_id=session_id,
+            trace_mode=tracing.mode(),
+            detector_backend=detector_backend,
+        )
+    )
+
+
+async def _classify_payload(
+    payload: bytes,
+    detect_face: bool,
+    wait: bool = False,
+    use_cache: bool = True,
+    session_id: str | None = None,
+    detector_backend: str = DEFAULT_DETECTOR_BACKEND,
+) -> dict:
+    analysis = None
+    if cache is not None and use_cache:
+        key = ResultCache.key(payload, detect_face, detector_backend, MODEL_VERSION)
+        with tracing.span("cache_lookup"):
+            analysis = await asyncio.to_thread(cache.get, key)
+    cached = analysis is not None
+    if analysis is None:
+        analysis = await _analyze_payload(
+            payload, detect_face, wait, session_id, detector_backend
+        )
+        # Результат по кропу от трекера зависит от прошлых кадров сессии,
+        # а не только от байтов: в кэш по содержимому его класть нельзя.
+        if cache is not None and use_cache and not analysis.get("tracked"):
+            entry = {k: v for k, v in analysis.items() if not k.startswith("near_duplicate")}
+            with tracing.span("cache_store"):
+                await asyncio.to_thread(cache.put, key, entry)
     emotion = analysis["dominant"]
+    metrics.dominant_emotions.inc(emotion=emotion)
+    with _stage("meme_lookup"):
+        meme_available = memes.has_meme(emotion)
     return {
         "mode": "face" if detect_face else "meme",
+        "detector_backend": detector_backend,
         "dominant_emotion": emotion,
         "confidence": analysis["confidence"],
         "emotions": analysis["emotions"],
-        "meme_available": memes.has_meme(emotion),
+        "meme_available": meme_available,
+        "cached": cached,
+        "near_duplicate": analysis.get("near_duplicate", False),
+        "near_duplicate_distance": analysis.get("near_duplicate_distance"),
+        "tracked": analysis.get("tracked", False),
     }
 
 
-def _encode_file(path: Path) -> str:
-    data = path.read_bytes()
-    encoded = base64.b64encode(data).decode("utf-8")
-    mime = "image/png" if path.suffix.lower() == ".png" else "image/jpeg"
-    return f"data:{mime};base64,{encoded}"
+# Элемент батча: имя, данные и ошибка, если данные получить не удалось.
+BatchItem = Tuple[str, Optional[bytes], Optional[str]]
+ARCHIVE_ERRORS = (zipfile.BadZipFile, tarfile.TarError, zlib.error, EOFError, OSError)
+
+
+def _read_capped(handle, declared: int, budget: int) -> Tuple[Optional[bytes], Optional[str]]:
+    """Читает элемент архива, не распаковывая больше лимитов."""
+    limit = min(BATCH_MAX_ITEM_BYTES, budget)
+    if declared > limit:
+        return None, _size_error(declared, budget)
+    # Заявленному размеру в заголовке верить нельзя: читаем на байт больше лимита.
+    payload = handle.read(limit + 1)
+    if len(payload) > limit:
+        return None, _size_error(len(payload), budget)
+    return payload, None
+
+
+def _size_error(size: int, budget: int) -> str:
+    if size > BATCH_MAX_ITEM_BYTES:
+        return f"File is over {BATCH_MAX_ITEM_BYTES // (1024 * 1024)} MB"
+    return f"Batch is over {BATCH_MAX_TOTAL_BYTES // (1024 * 1024)} MB"
+
+
+def _iter_archive(upload: UploadFile, budget: int) -> Iterator[BatchItem]:
+    """Изображения из zip/tar; битый архив или элемент становится ошибкой, а не исключением."""
+    name = (upload.filename or "").lower()
+    try:
+        if name.endswith(".zip"):
+            with zipfile.ZipFile(upload.file) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or Path(info.filename).suffix.lower() not in IMAGE_SUFFIXES:
+                        continue
+                    try:
+                        with archive.open(info) as handle:
+                            payload, error = _read_capped(handle, info.file_size, budget)
+                    except ARCHIVE_ERRORS as exc:
+                        payload, error = None, f"Cannot extract: {exc}"
+                    budget -= len(payload or b"")
+                    yield info.filename, payload, error
+        else:
+            with tarfile.open(fileobj=upload.file, mode="r:*") as archive:
+                for member in archive:
+                    if not member.isfile() or Path(member.name).suffix.lower() not in IMAGE_SUFFIXES:
+                        continue
+                    handle = archive.extractfile(member)
+                    if handle is None:
+                        continue
+                    payload, error = _read_capped(handle, member.size, budget)
+                    budget -= len(payload or b"")
+                    yield member.name, payload, error
+    except ARCHIVE_ERRORS as exc:
+        # Заголовки ответа уже ушли: ошибка архива — отдельная строка NDJSON.
+        yield upload.filename or "archive", None, f"Cannot read archive: {exc}"
+
+
+def _is_archive(upload: UploadFile) -> bool:
+    name = (upload.filename or "").lower()
+    return name.endswith((".zip", ".tar", ".tar.gz", ".tgz"))
+
+
+async def _iter_batch_items(files: List[UploadFile]) -> AsyncIterator[BatchItem]:
+    count = 0
+    budget = BATCH_MAX_TOTAL_BYTES
+    for upload in files:
+        if _is_archive(upload):
+            items = _iter_archive(upload, budget)
+        else:
+            name = upload.filename or f"file-{count}"
+            payload = await upload.read()
+            if len(payload) > min(BATCH_MAX_ITEM_BYTES, budget):
+                items = iter([(name, None, _size_error(len(payload), budget))])
+            else:
+                items = iter([(name, payload, None)])
+        try:
+            while True:
+                # Распаковка синхронная, поэтому не в event loop.
+                item = await asyncio.to_thread(next, items, None)
+                if item is None:
+                    break
+                if count >= BATCH_MAX_ITEMS:
+                    # Клиент должен видеть, что хвост архива не обработан.
+                    yield item[0], None, (
+                        f"Batch truncated at EMOTION_BATCH_MAX_ITEMS={BATCH_MAX_ITEMS}: "
+                        "this and all later files were not classified"
+                    )
+                    return
+                count += 1
+                budget -= len(item[1] or b"")
+                yield item
+        finally:
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+
+
+async def _classify_item(
+    index: int,
+    name: str,
+    payload: Optional[bytes],
+    error: Optional[str],
+    detect_face: bool,
+    use_cache: bool,
+    detector_backend: str,
+) -> dict:
+    record = {"index": index, "filename": name}
+    if payload is None:
+        record["error"] = error
+        return record
+    metrics.payload_bytes.observe(len(payload))
+    try:
+        if not payload:
+            raise ValueError("Empty payload")
+        record.update(
+            await _classify_payload(
+                payload,
+                detect_face,
+                wait=True,
+                use_cache=use_cache,
+                detector_backend=detector_backend,
+            )
+        )
+    except HTTPException as exc:
+        record["error"] = exc.detail
+    except Exception as exc:
+        record["error"] = str(exc) or exc.__class__.__name__
+    return record
+
+
+async def _stream_batch(
+    files: List[UploadFile], detect_face: bool, use_cache: bool, detector_backend: str
+) -> AsyncIterator[str]:
+    pending: set[asyncio.Task] = set()
+    index = 0
+    try:
+        async for name, payload, error in _iter_batch_items(files):
+            pending.add(
+                asyncio.create_task(
+                    _classify_item(
+                        index, name, payload, error, detect_face, use_cache, detector_backend
+                    )
+                )
+            )
+            index += 1
+            if len(pending) < pool.workers:
+                continue
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield json.dumps(task.result(), ensure_ascii=False) + "\n"
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield json.dumps(task.result(), ensure_ascii=False) + "\n"
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _spool_upload(file: UploadFile) -> str:
+    """Копирует загрузку во временный файл: VideoCapture читает только с диска."""
+    suffix = Path(file.filename or "").suffix.lower()
+    handle = tempfile.NamedTemporaryFile(
+        prefix="emotion-video-", suffix=suffix if suffix in VIDEO_SUFFIXES else "", delete=False
+    )
+    size = 0
+    try:
+        with handle, _stage("upload_read"):
+            while chunk := await file.read(1024 * 1024):
+                size += len(chunk)
+                if size > VIDEO_MAX_BYTES:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Video is over {VIDEO_MAX_BYTES // (1024 * 1024)} MB",
+                    )
+                await asyncio.to_thread(handle.write, chunk)
+        if not size:
+            raise HTTPException(status_code=400, detail="Empty payload")
+    except BaseException:
+        os.unlink(handle.name)
+        raise
+    metrics.payload_bytes.observe(size)
+    return handle.name
+
+
+class _SpooledVideo:
+    """Временный файл ролика и его декодер; освобождаются ровно один раз.
+
+    ``release`` вызывают и finally генератора ответа, и фоновая задача
+    ответа: если клиент ушёл до начала тела, генератор не стартует и его
+    finally не выполнится.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.video: Optional[VideoFrames] = None
+        self.batches: Optional[Iterator[List[SampledFrame]]] = None
+        self.decoding: Optional[asyncio.Future] = None
+        self.released = False
+
+    def release(self) -> None:
+        if self.released:
+            return
+        if self.decoding is not None:
+            if not self.decoding.done():
+                # Поток декодирования не отменить: закрываем файл, когда он закончит.
+                # Ожидание в finally отменила бы отмена области ответа.
+                self.decoding.add_done_callback(lambda _: self.release())
+                return
+            if not self.decoding.cancelled():
+                self.decoding.exception()
+        self.released = True
+        if self.batches is not None:
+            self.batches.close()
+        if self.video is not None:
+            self.video.close()
+        Path(self.path).unlink(missing_ok=True)
+
+    async def close(self) -> None:
+        # Асинхронная, чтобы Starlette вызвал её в event loop, а не в пуле потоков.
+        self.release()
+
+
+async def _stream_video(
+    spooled: _SpooledVideo,
+    sampling: Sampling,
+    detect_face: bool,
+    detector_backend: str,
+) -> AsyncIterator[str]:
+    started = time.perf_counter()
+    video = spooled.video
+    batches = spooled.batches = batched(video.sample(sampling), VIDEO_BATCH_SIZE)
+    # Следующий батч декодируется в потоке, пока текущий в инференсе.
+    decoding = spooled.decoding = asyncio.ensure_future(asyncio.to_thread(next, batches, None))
+    summary = {"frames_sampled": 0, "faces_found": 0, "emotions": {}}
+    try:
+        yield json.dumps(
+            {
+                "type": "meta",
+                "fps": video.fps,
+                "frame_count": video.frame_count,
+                "duration": round(video.duration, 3),
+                "sampling": sampling.mode,
+            }
+        ) + "\n"
+        while True:
+            batch = await decoding
+            if batch is None:
+                break
+            decoding = spooled.decoding = asyncio.ensure_future(
+                asyncio.to_thread(next, batches, None)
+            )
+            try:
+                analysis = await _run_inference(
+                    pool.analyze_frames(
+                        [item.frame for item in batch],
+                        detect_face,
+                        wait=True,
+                        trace_mode=tracing.mode(),
+                        detector_backend=detector_backend,
+                    )
+                )
+            except HTTPException as exc:
+                yield json.dumps({"type": "error", "error": exc.detail}) + "\n"
+                return
+            lines = []
+            for item, result in zip(batch, analysis["results"]):
+                entry = timeline_entry(item, result)
+                summary["frames_sampled"] += 1
+                if "dominant_emotion" in entry:
+                    summary["faces_found"] += entry["face_found"]
+                    emotion = entry["dominant_emotion"]
+                    summary["emotions"][emotion] = summary["emotions"].get(emotion, 0) + 1
+                lines.append(json.dumps({"type": "frame", **entry}, ensure_ascii=False) + "\n")
+            yield "".join(lines)
+        yield json.dumps(
+            {
+                "type": "summary",
+                **summary,
+                "frames_decoded": video.decoded,
+                "elapsed_s": round(time.perf_counter() - started, 3),
+            }
+        ) + "\n"
+    finally:
+        spooled.release()
+
+
+async def _encode_file(meme: MemeFile) -> str:
+    data = await delivery.read_all(meme)
+    with _stage("encode"):
+        encoded = base64.b64encode(data).decode("utf-8")
+    return f"data:{content_type(meme)};base64,{encoded}"
+
+
+def _check_size(size: str | None) -> None:
+    if size is not None and size not in VARIANT_SIZES:
+        raise HTTPException(
+            status_code=422, detail=f"Unknown size, expected one of {list(VARIANT_SIZES)}"
+        )
+
+
+def _pick_meme(emotion: str) -> MemeFile:
+    emotion = emotion.lower()
+    if emotion not in EMOTIONS:
+        raise HTTPException(status_code=404, detail="Unknown emotion")
+    with _stage("meme_lookup"):
+        candidate = memes.pick(emotion)
+    if not candidate:
+        raise HTTPException(status_code=404, detail="Meme not found")
+    return candidate
+
+
+@app.get("/health/live")
+async def health_live() -> dict:
+    return {"status": "ok"}
+
+
+@app.get("/health/ready")
+async def health_ready() -> JSONResponse:
+    body = {"status": pool.state, "error": pool.load_error}
+    if shared is None:
+        return JSONResponse(body, status_code=200 if pool.ready else 503)
+    # Префорк: узел готов, только когда готовы все его воркеры.
+    workers = [{"pid": os.getpid(), **body}] + [
+        {"pid": state["pid"], "status": state.get("status"), "error": state.get("error")}
+        for state in await asyncio.to_thread(shared.others)
+    ]
+    statuses = {worker["status"] for worker in workers}
+    ready = statuses == {"ready"} and len(workers) >= shared.expected
+    status = "ready" if ready else "failed" if "failed" in statuses else "loading"
+    return JSONResponse(
+        {"status": status, "workers": sorted(workers, key=lambda worker: worker["pid"])},
+        status_code=200 if ready else 503,
+    )
 
 
 @app.get("/health")
 async def health() -> dict:
-    return {"status": "ok", "model_loaded": True}
+    return {
+        "status": "ok",
+        "model_loaded": pool.ready,
+        "inference": pool.stats(),
+        "meme_cache": delivery.cache.stats(),
+    }
 
 
 @app.get("/emotions")
@@ -66,26 +639,204 @@ async def emotions() -> dict:
     return {"emotions": EMOTIONS}
 
 
+@app.get("/metrics")
+async def metrics_endpoint() -> PlainTextResponse:
+    others = []
+    if shared is not None:
+        others = [state["metrics"] for state in await asyncio.to_thread(shared.others)]
+    return PlainTextResponse(
+        metrics.registry.render(others), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.get("/cache/stats")
+async def cache_stats() -> dict:
+    if cache is None:
+        return {"enabled": False}
+    others = []
+    if shared is not None:
+        others = [
+            state["metrics"].get(metrics.cache_lookups.name, [])
+            for state in await asyncio.to_thread(shared.others)
+        ]
+    return {"enabled": True, **await asyncio.to_thread(cache.stats, others)}
+
+
 @app.post("/classify")
 async def classify(
     file: UploadFile = File(...),
     detect_face: bool = True,
+    use_cache: bool = True,
+    session_id: str | None = None,
+    detector_backend: str | None = None,
 ) -> dict:
-    payload = await file.read()
-    if not payload:
-        raise HTTPException(status_code=400, detail="Empty payload")
-    return _classify_payload(payload, detect_face)
+    backend = _resolve_detector(detector_backend)
+    payload = await _read_upload(file)
+    return await _classify_payload(
+        payload,
+        detect_face,
+        use_cache=use_cache,
+        session_id=session_id,
+        detector_backend=backend,
+    )
 
 
-@app.get("/meme/{emotion}/base64")
-async def meme(emotion: str) -> dict:
-    emotion = emotion.lower()
-    if emotion not in EMOTIONS:
-        raise HTTPException(status_code=404, detail="Unknown emotion")
-    candidate = memes.pick_random(emotion)
+@app.post("/classify/faces")
+async def classify_faces(
+    file: UploadFile = File(...),
+    max_faces: int | None = None,
+    min_face_size: int | None = None,
+    detector_backend: str | None = None,
+) -> dict:
+    backend = _resolve_detector(detector_backend)
+    payload = await _read_upload(file)
+    analysis = await _run_inference(
+        pool.analyze_faces(
+            payload,
+            max_faces,
+            min_face_size,
+            trace_mode=tracing.mode(),
+            detector_backend=backend,
+        )
+    )
+    faces = analysis["faces"]
+    for face in faces:
+        metrics.dominant_emotions.inc(emotion=face["dominant"])
+    return {
+        "detector_backend": backend,
+        "count": len(faces),
+        "faces": [
+            {
+                "box": face["box"],
+                "dominant_emotion": face["dominant"],
+                "confidence": face["confidence"],
+                "emotions": face["emotions"],
+                "meme_available": memes.has_meme(face["dominant"]),
+            }
+            for face in faces
+        ],
+    }
+
+
+@app.post("/classify/batch")
+async def classify_batch(
+    files: List[UploadFile] = File(...),
+    detect_face: bool = True,
+    use_cache: bool = True,
+    detector_backend: str | None = None,
+) -> StreamingResponse:
+    """NDJSON, по строке на файл (картинки и содержимое zip/tar).
+
+    Ошибки — строки с полем ``error``. Файлов не больше
+    EMOTION_BATCH_MAX_ITEMS: на первом лишнем приходит строка об обрезке,
+    её ``index`` — первый необработанный файл.
+    """
+    backend = _resolve_detector(detector_backend)
+    return StreamingResponse(
+        _stream_batch(files, detect_face, use_cache, backend), media_type="application/x-ndjson"
+    )
+
+
+@app.post("/classify/video")
+async def classify_video(
+    file: UploadFile = File(...),
+    sampling: str = "fps",
+    every: int = 10,
+    fps: float = 2.0,
+    scene_threshold: float = 0.12,
+    max_frames: int | None = None,
+    detect_face: bool = True,
+    detector_backend: str | None = None,
+) -> StreamingResponse:
+    backend = _resolve_detector(detector_backend)
+    try:
+        plan = Sampling(mode=sampling, every=every, fps=fps, scene_threshold=scene_threshold)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+    if max_frames:
+        plan.max_frames = min(max_frames, plan.max_frames)
+    _require_ready()
+    spooled = _SpooledVideo(await _spool_upload(file))
+    try:
+        try:
+            spooled.video = await asyncio.to_thread(VideoFrames, spooled.path, VIDEO_MAX_SIDE)
+        except ValueError as exc:
+            raise HTTPException(status_code=415, detail=str(exc))
+        return StreamingResponse(
+            _stream_video(spooled, plan, detect_face, backend),
+            media_type="application/x-ndjson",
+            background=BackgroundTask(spooled.close),
+        )
+    except BaseException:
+        spooled.release()
+        raise
+
+
+@app.websocket("/ws/classify")
+async def classify_stream(
+    websocket: WebSocket,
+    detect_face: bool = True,
+    max_fps: float | None = None,
+    max_in_flight: int | None = None,
+    detector_backend: str | None = None,
+) -> None:
+    try:
+        backend = _resolve_detector(detector_backend)
+    except HTTPException as exc:
+        await websocket.close(code=1008, reason=exc.detail)
+        return
+    await websocket.accept()
+    session_id = uuid.uuid4().hex
+    fps = min(max_fps, WS_MAX_FPS) if max_fps and max_fps > 0 else WS_MAX_FPS
+    in_flight = min(max_in_flight or WS_MAX_IN_FLIGHT, WS_MAX_IN_FLIGHT)
+    stats = await run_session(
+        websocket,
+        lambda payload: _classify_payload(
+            payload,
+            detect_face,
+            use_cache=False,
+            session_id=session_id,
+            detector_backend=backend,
+        ),
+        max_fps=fps,
+        max_in_flight=in_flight,
+    )
+    logger.info("Stream session %s closed: %s", session_id, stats)
+
+
+@app.get("/meme/id/{meme_id}")
+async def meme_by_id(meme_id: str, request: Request, size: str | None = None) -> Response:
+    _check_size(size)
+    candidate = memes.get(meme_id)
     if not candidate:
         raise HTTPException(status_code=404, detail="Meme not found")
-    return {"emotion": emotion, "image": _encode_file(candidate)}
+    served = variants.resolve(candidate, size)
+    # immutable только если отдан именно запрошенный вариант.
+    cache_control = FALLBACK if size and served is candidate else IMMUTABLE
+    return await delivery.respond(request, served, cache_control=cache_control)
+
+
+@app.get("/meme/{emotion}")
+async def meme_binary(emotion: str, request: Request, size: str | None = None) -> Response:
+    _check_size(size)
+    candidate = _pick_meme(emotion)
+    response = await delivery.respond(
+        request, variants.resolve(candidate, size), cache_control="no-cache"
+    )
+    location = f"/meme/id/{candidate.meme_id}"
+    response.headers["Content-Location"] = f"{location}?size={size}" if size else location
+    return response
+
+
+@app.get("/meme/{emotion}/base64")
+async def meme(emotion: str, size: str | None = None) -> dict:
+    _check_size(size)
+    candidate = _pick_meme(emotion)
+    return {
+        "emotion": emotion.lower(),
+        "id": candidate.meme_id,
+        "image": await _encode_file(variants.resolve(candidate, size)),
+    }
 
 
 def _is_port_in_use(port: int) -> bool:
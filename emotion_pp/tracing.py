@@ -0,0 +1,294 @@
+"""
+Трассировка запросов: дерево спанов на запрос и выборочный cProfile.
+
+Включается переменной ``EMOTION_TRACE_PATH``. Трассы медленных запросов
+(дольше ``EMOTION_TRACE_SLOW_MS``) дописываются в файл формата Chrome
+trace (открывается в chrome://tracing или Perfetto) с ротацией по размеру,
+профили cProfile кладутся рядом в ``<path>.profiles/*.prof``. Без
+включённой трассировки ``span`` сводится к чтению одной ContextVar.
+
+cProfile видит только свой поток, поэтому у профилируемого запроса два
+профиля: потока воркера (декодирование, детекция, выравнивание) и потока
+MicroBatcher за проход модели, в который попали его кропы. Второй общий
+для всех запросов этого батча.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import cProfile
+import itertools
+import json
+import logging
+import marshal
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger("emotion_api.tracing")
+
+TRACE_MODES = ("spans", "profile")
+
+
+class Span:
+    __slots__ = ("name", "start_ns", "end_ns", "args", "children")
+
+    def __init__(self, name: str, args: Optional[Dict[str, Any]] = None) -> None:
+        self.name = name
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns = self.start_ns
+        self.args = args or {}
+        self.children: List[Span] = []
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def export(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "args": self.args,
+            "children": [child.export() for child in self.children],
+        }
+
+    @classmethod
+    def restore(cls, data: Dict[str, Any]) -> "Span":
+        span = cls(data["name"], data["args"])
+        span.start_ns, span.end_ns = data["start_ns"], data["end_ns"]
+        span.children = [cls.restore(child) for child in data["children"]]
+        return span
+
+
+_current: ContextVar[Optional[Span]] = ContextVar("emotion_trace_span", default=None)
+_root: ContextVar[Optional[Span]] = ContextVar("emotion_trace_root", default=None)
+_mode: ContextVar[Optional[str]] = ContextVar("emotion_trace_mode", default=None)
+_profile_sink: ContextVar[Optional[List[bytes]]] = ContextVar("emotion_profile_sink", default=None)
+
+
+@contextmanager
+def span(name: str, **args: Any) -> Iterator[None]:
+    parent = _current.get()
+    if parent is None:
+        yield
+        return
+    child = Span(name, args)
+    parent.children.append(child)
+    token = _current.set(child)
+    try:
+        yield
+    finally:
+        child.end_ns = time.perf_counter_ns()
+        _current.reset(token)
+
+
+def mode() -> Optional[str]:
+    """Режим трассировки текущего запроса для передачи в воркер пула."""
+    return _mode.get()
+
+
+def profile_sink() -> Optional[List[bytes]]:
+    """Список, куда другие потоки кладут профили для профилируемого запроса."""
+    return _profile_sink.get()
+
+
+def profile_stats(profiler: cProfile.Profile) -> bytes:
+    profiler.create_stats()
+    return marshal.dumps(profiler.stats)
+
+
+def attach(exported: Optional[Dict[str, Any]]) -> None:
+    """Подвешивает спаны воркера к текущему спану запроса."""
+    parent = _current.get()
+    if parent is None or not exported:
+        return
+    parent.children.extend(Span.restore(child) for child in exported["spans"])
+    profiles = exported.get("profiles")
+    if profiles:
+        root = _root.get()
+        if root is not None:
+            root.args.setdefault("_profiles", []).extend(profiles)
+
+
+@contextmanager
+def collect(trace_mode: Optional[str]) -> Iterator[Dict[str, Any]]:
+    """Сбор спанов (и профиля) внутри воркера; результат кладётся в словарь."""
+    exported: Dict[str, Any] = {}
+    if trace_mode not in TRACE_MODES:
+        yield exported
+        return
+    holder = Span("worker", {"pid": os.getpid(), "thread": threading.current_thread().name})
+    token = _current.set(holder)
+    profiler = cProfile.Profile() if trace_mode == "profile" else None
+    # Профили батчера попадают сюда, пока воркер ждёт результат.
+    sink: List[bytes] = []
+    sink_token = _profile_sink.set(sink if profiler is not None else None)
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield exported
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            exported["profiles"] = [profile_stats(profiler), *sink]
+        holder.end_ns = time.perf_counter_ns()
+        _profile_sink.reset(sink_token)
+        _current.reset(token)
+        exported["spans"] = [holder.export()]
+
+
+class Tracer:
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        sample_rate: float = 1.0,
+        slow_ms: float = 1000.0,
+        profile_rate: float = 0.0,
+        max_bytes: int = 10 * 1024 * 1024,
+        backups: int = 3,
+        max_profiles: int = 100,
+    ) -> None:
+        self.path = path
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.profile_rate = profile_rate
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.max_profiles = max_profiles
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "Tracer":
+        path = os.getenv("EMOTION_TRACE_PATH")
+        return cls(
+            path=Path(path) if path else None,
+            sample_rate=float(os.getenv("EMOTION_TRACE_SAMPLE_RATE", "1.0")),
+            slow_ms=float(os.getenv("EMOTION_TRACE_SLOW_MS", "1000")),
+            profile_rate=float(os.getenv("EMOTION_TRACE_PROFILE_RATE", "0")),
+            max_bytes=int(os.getenv("EMOTION_TRACE_MAX_MB", "10")) * 1024 * 1024,
+            backups=int(os.getenv("EMOTION_TRACE_BACKUPS", "3")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None and self.sample_rate > 0
+
+    @contextmanager
+    def request(self, name: str, **args: Any) -> Iterator[Optional[Span]]:
+        if not self.enabled or random.random() >= self.sample_rate:
+            yield None
+            return
+        root = Span(name, args)
+        trace_mode = "profile" if random.random() < self.profile_rate else "spans"
+        tokens = (_current.set(root), _root.set(root), _mode.set(trace_mode))
+        try:
+            yield root
+        finally:
+            root.end_ns = time.perf_counter_ns()
+            for var, token in zip((_current, _root, _mode), tokens):
+                var.reset(token)
+
+    def should_write(self, root: Optional[Span]) -> bool:
+        return root is not None and root.duration_ms >= self.slow_ms
+
+    def write(self, root: Span) -> None:
+        trace_id = next(self._ids)
+        profiles = root.args.pop("_profiles", [])
+        with self._lock:
+            if profiles:
+                root.args["profiles"] = self._write_profiles(trace_id, profiles)
+            events = self._events(root, trace_id)
+            self._rotate()
+            fresh = not self.path.exists()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as handle:
+                # Формат Chrome trace допускает массив без закрывающей скобки,
+                # поэтому события можно просто дописывать.
+                if fresh:
+                    handle.write("[\n")
+                for event in events:
+                    handle.write(json.dumps(event, ensure_ascii=False, default=str) + ",\n")
+
+    def _events(self, root: Span, trace_id: int) -> List[Dict[str, Any]]:
+        pid = os.getpid()
+        events: List[Dict[str, Any]] = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": trace_id,
+             "args": {"name": f"#{trace_id} {root.name}"}},
+        ]
+        stack = [root]
+        while stack:
+            current = stack.pop()
+            events.append(
+                {
+                    "name": current.name,
+                    "cat": "emotion",
+                    "ph": "X",
+                    "ts": current.start_ns / 1000,
+                    "dur": (current.end_ns - current.start_ns) / 1000,
+                    "pid": pid,
+                    "tid": trace_id,
+                    "args": current.args,
+                }
+            )
+            stack.extend(current.children)
+        return events
+
+    def _rotate(self) -> None:
+        try:
+            if self.path.stat().st_size < self.max_bytes:
+                return
+        except FileNotFoundError:
+            return
+        for index in range(self.backups - 1, 0, -1):
+            older = self.path.with_name(f"{self.path.name}.{index}")
+            if older.exists():
+                os.replace(older, self.path.with_name(f"{self.path.name}.{index + 1}"))
+        if self.backups > 0:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink()
+
+    def _write_profiles(self, trace_id: int, profiles: List[bytes]) -> List[str]:
+        folder = self.path.with_name(f"{self.path.name}.profiles")
+        folder.mkdir(parents=True, exist_ok=True)
+        written = []
+        for index, data in enumerate(profiles):
+            # marshal-словарь статистики cProfile: то же, что пишет dump_stats.
+            target = folder / f"{os.getpid()}-{trace_id}-{index}.prof"
+            target.write_bytes(data)
+            written.append(str(target))
+        existing = sorted(folder.glob("*.prof"), key=lambda item: item.stat().st_mtime)
+        for stale in existing[: max(0, len(existing) - self.max_profiles)]:
+            stale.unlink(missing_ok=True)
+        return written
+
+
+tracer = Tracer.from_env()
+
+
+class TracingMiddleware:
+    """ASGI-middleware: корневой спан на HTTP-запрос и запись медленных трасс."""
+
+    def __init__(self, app: Any, tracer: Tracer) -> None:
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        name = f"{scope['method']} {scope['path']}"
+        with self.tracer.request(name, query=scope.get("query_string", b"").decode("latin-1")) as root:
+            await self.app(scope, receive, send)
+        if self.tracer.should_write(root):
+            try:
+                await asyncio.to_thread(self.tracer.write, root)
+            except OSError as exc:
+                logger.warning("Cannot write trace: %s", exc)
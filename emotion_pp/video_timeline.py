@@ -0,0 +1,148 @@
+"""
+Выборка кадров из видео и анимированных GIF для временной шкалы эмоций.
+
+Кадры читаются из файла по одному через cv2.VideoCapture, пропущенные
+кадры только извлекаются из потока без конвертации, поэтому память не
+зависит от длины ролика. Режимы выборки: каждый k-й кадр (``every``),
+фиксированная частота (``fps``) и смена сцены (``scene``).
+"""
+
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+import cv2
+import numpy as np
+
+SAMPLING_MODES = ("every", "fps", "scene")
+VIDEO_SUFFIXES = {".mp4", ".webm", ".gif", ".mov", ".mkv", ".avi"}
+SCENE_THUMB_SIDE = 32
+# У GIF и части WebM нет частоты кадров в метаданных.
+FALLBACK_FPS = 10.0
+
+
+class SampledFrame(NamedTuple):
+    index: int
+    timestamp: float
+    frame: np.ndarray
+    # Во сколько раз исходный кадр больше отданного (после max_side).
+    scale: float
+
+
+@dataclass
+class Sampling:
+    mode: str = "fps"
+    every: int = 10
+    fps: float = 2.0
+    scene_threshold: float = 0.12
+    max_frames: int = field(
+        default_factory=lambda: int(os.getenv("EMOTION_VIDEO_MAX_FRAMES", "3000"))
+    )
+
+    def __post_init__(self) -> None:
+        if self.mode not in SAMPLING_MODES:
+            raise ValueError(f"Unknown sampling mode: {self.mode}, expected one of {SAMPLING_MODES}")
+        if self.every < 1 or self.fps <= 0 or not 0 < self.scene_threshold <= 1:
+            raise ValueError("every must be >= 1, fps > 0 and scene_threshold in (0, 1]")
+
+
+def _thumbnail(frame: np.ndarray) -> np.ndarray:
+    gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (SCENE_THUMB_SIDE, SCENE_THUMB_SIDE), interpolation=cv2.INTER_AREA)
+
+
+class VideoFrames:
+    """Открытый ролик; ``sample`` лениво отдаёт выбранные кадры."""
+
+    def __init__(self, path: str, max_side: Optional[int] = None) -> None:
+        self._capture = cv2.VideoCapture(path)
+        if not self._capture.isOpened():
+            self._capture.release()
+            raise ValueError("Cannot decode video")
+        self.max_side = max_side
+        fps = self._capture.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if 0 < fps < 1000 else FALLBACK_FPS
+        self.frame_count = max(0, int(self._capture.get(cv2.CAP_PROP_FRAME_COUNT)))
+        self.decoded = 0
+
+    @property
+    def duration(self) -> float:
+        return self.frame_count / self.fps if self.frame_count else 0.0
+
+    def _timestamp(self, index: int) -> float:
+        position = self._capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        return position if position > 0 or index == 0 else index / self.fps
+
+    def _retrieve(self) -> Optional[SampledFrame]:
+        ok, frame = self._capture.retrieve()
+        if not ok:
+            return None
+        scale = 1.0
+        if self.max_side and max(frame.shape[:2]) > self.max_side:
+            scale = max(frame.shape[:2]) / self.max_side
+            frame = cv2.resize(frame, None, fx=1 / scale, fy=1 / scale, interpolation=cv2.INTER_AREA)
+        return SampledFrame(-1, 0.0, frame, scale)
+
+    def sample(self, sampling: Sampling) -> Iterator[SampledFrame]:
+        next_time = 0.0
+        previous: Optional[np.ndarray] = None
+        emitted = 0
+        index = -1
+        while emitted < sampling.max_frames and self._capture.grab():
+            index += 1
+            self.decoded += 1
+            timestamp = self._timestamp(index)
+            if sampling.mode == "every":
+                if index % sampling.every:
+                    continue
+            elif sampling.mode == "fps":
+                if timestamp + 1e-6 < next_time:
+                    continue
+                next_time += 1 / sampling.fps
+                if next_time <= timestamp:
+                    next_time = timestamp + 1 / sampling.fps
+            sampled = self._retrieve()
+            if sampled is None:
+                continue
+            if sampling.mode == "scene":
+                thumb = _thumbnail(sampled.frame)
+                if previous is not None:
+                    change = float(np.mean(cv2.absdiff(thumb, previous))) / 255
+                    if change < sampling.scene_threshold:
+                        continue
+                previous = thumb
+            emitted += 1
+            yield sampled._replace(index=index, timestamp=timestamp)
+
+    def close(self) -> None:
+        self._capture.release()
+
+
+def timeline_entry(sampled: SampledFrame, result: Optional[Dict]) -> Dict:
+    entry: Dict = {"frame": sampled.index, "t": round(sampled.timestamp, 3)}
+    if result is None:
+        return {**entry, "face_found": False}
+    box = result.get("box")
+    if box is not None:
+        box = {key: round(value * sampled.scale) for key, value in box.items()}
+    return {
+        **entry,
+        "face_found": box is not None,
+        "box": box,
+        "dominant_emotion": result["dominant"],
+        "confidence": result["confidence"],
+        "emotions": result["emotions"],
+    }
+
+
+def batched(frames: Iterator[SampledFrame], size: int) -> Iterator[List[SampledFrame]]:
+    batch: List[SampledFrame] = []
+    for frame in frames:
+        batch.append(frame)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
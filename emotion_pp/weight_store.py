@@ -0,0 +1,315 @@
+"""
+Хранилище весов модели: проверка sha256, атомарная запись, докачка и зеркало.
+
+Файл скачивается в ``<name>.part`` и переименовывается только после
+проверки, поэтому оборванная загрузка не оставляет битый ``.h5``, а при
+следующем запуске докачивается с места обрыва (HTTP Range). Ожидаемый
+хэш берётся из ``EMOTION_WEIGHTS_SHA256`` (``name=hex,...``), из
+спецификации или из файла ``<name>.sha256`` рядом с весами или на
+зеркале. Локальный ``.sha256`` пишется только после проверки по
+закреплённому хэшу или хэшу зеркала. Без известного хэша файл не
+благословляется: у HDF5 сверяется размер с адресом конца файла из
+суперблока, так что обрезанный ``.h5`` отбрасывается и качается заново.
+
+Переменные: EMOTION_WEIGHTS_MIRROR (каталог или http(s)-адрес),
+EMOTION_WEIGHTS_OFFLINE (не ходить в сеть, сразу падать без весов).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import shutil
+import struct
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional
+from urllib.parse import urlparse
+
+import requests
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger("emotion_api.weights")
+
+CHUNK_SIZE = 1024 * 1024
+HDF5_SIGNATURE = b"\x89HDF\r\n\x1a\n"
+UNDEFINED_ADDRESS = 0xFFFFFFFFFFFFFFFF
+
+
+class WeightSpec(NamedTuple):
+    filename: str
+    url: str
+    sha256: Optional[str] = None
+
+
+class WeightsUnavailable(RuntimeError):
+    """Весов нет локально, а получить их нельзя или они не прошли проверку."""
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as handle:
+        while chunk := handle.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_digest(text: str) -> Optional[str]:
+    # Формат sha256sum: "<hex>  <имя>" или просто "<hex>".
+    parts = text.split()
+    return parts[0].lower() if parts else None
+
+
+def _hdf5_complete(path: Path) -> bool:
+    """Размер файла не меньше адреса конца файла из суперблока HDF5."""
+    with path.open("rb") as handle:
+        head = handle.read(64)
+    if not head.startswith(HDF5_SIGNATURE) or len(head) < 16:
+        return False
+    version = head[8]
+    if version in (0, 1):
+        offsets = head[13]
+        # Перед адресами 24 байта полей, у версии 1 ещё 4 байта indexed storage K.
+        base_at = 24 + (4 if version == 1 else 0)
+    else:
+        offsets = head[9]
+        base_at = 12
+    end_at = base_at + 2 * offsets
+    if offsets not in (2, 4, 8) or len(head) < end_at + offsets:
+        return False
+    fmt = {2: "<H", 4: "<I", 8: "<Q"}[offsets]
+    (base,) = struct.unpack_from(fmt, head, base_at)
+    (end,) = struct.unpack_from(fmt, head, end_at)
+    return end != UNDEFINED_ADDRESS and path.stat().st_size >= base + end
+
+
+def _looks_complete(path: Path, filename: str) -> bool:
+    """Проверка без хэша: файл не пустой, а ``.h5`` не обрезан."""
+    if path.stat().st_size == 0:
+        return False
+    return _hdf5_complete(path) if filename.endswith(".h5") else True
+
+
+def _env_digests() -> Dict[str, str]:
+    digests = {}
+    for item in os.getenv("EMOTION_WEIGHTS_SHA256", "").split(","):
+        name, _, value = item.strip().partition("=")
+        if name and value:
+            digests[name] = value.lower()
+    return digests
+
+
+class WeightStore:
+    def __init__(
+        self,
+        root: Path,
+        mirror: Optional[str] = None,
+        offline: bool = False,
+        timeout: float = 60.0,
+        retries: int = 3,
+    ) -> None:
+        self.root = root
+        self.mirror = mirror.rstrip("/") if mirror else None
+        self.offline = offline
+        self.timeout = timeout
+        self.retries = retries
+
+    @classmethod
+    def from_env(cls, root: Path) -> "WeightStore":
+        return cls(
+            root,
+            mirror=os.getenv("EMOTION_WEIGHTS_MIRROR") or None,
+            offline=os.getenv("EMOTION_WEIGHTS_OFFLINE", "0").lower() in ("1", "true", "yes", "on"),
+            timeout=float(os.getenv("EMOTION_WEIGHTS_TIMEOUT", "60")),
+        )
+
+    def ensure(self, spec: WeightSpec) -> Path:
+        """Путь к проверенному файлу весов; при необходимости скачивает его."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        target = self.root / spec.filename
+        with self._locked(target):
+            expected = self._expected(spec) or self._mirror_digest(self._mirror_source(spec))
+            if target.exists():
+                if expected is None:
+                    if _looks_complete(target, spec.filename):
+                        logger.warning(
+                            "No checksum for %s, using the existing file unverified; "
+                            "set EMOTION_WEIGHTS_SHA256 to pin it",
+                            spec.filename,
+                        )
+                        return target
+                    logger.warning("%s is truncated or corrupt, fetching again", spec.filename)
+                else:
+                    actual = _sha256(target)
+                    if actual == expected:
+                        self._record(target, actual)
+                        return target
+                    logger.warning(
+                        "%s checksum mismatch (%s != %s), fetching again",
+                        spec.filename,
+                        actual,
+                        expected,
+                    )
+                target.unlink()
+            return self._fetch(spec, target, expected)
+
+    def _expected(self, spec: WeightSpec) -> Optional[str]:
+        pinned = _env_digests().get(spec.filename) or spec.sha256
+        if pinned:
+            return pinned.lower()
+        # Локальный .sha256 появляется только после проверки по
+        # закреплённому хэшу или хэшу зеркала, поэтому ему можно верить.
+        sidecar = self._sidecar(self.root / spec.filename)
+        if sidecar.exists():
+            return _read_digest(sidecar.read_text())
+        return None
+
+    @staticmethod
+    def _sidecar(path: Path) -> Path:
+        return path.with_name(path.name + ".sha256")
+
+    def _record(self, target: Path, digest: str) -> None:
+        sidecar = self._sidecar(target)
+        if not sidecar.exists():
+            sidecar.write_text(f"{digest}  {target.name}\n")
+
+    def _mirror_source(self, spec: WeightSpec) -> Optional[str]:
+        return f"{self.mirror}/{spec.filename}" if self.mirror else None
+
+    def _sources(self, spec: WeightSpec) -> List[str]:
+        sources = []
+        if self.mirror:
+            sources.append(self._mirror_source(spec))
+        if not self.offline:
+            sources.append(spec.url)
+        # Офлайн разрешены только локальные зеркала.
+        return [source for source in sources if not self.offline or not _is_http(source)]
+
+    def _fetch(self, spec: WeightSpec, target: Path, expected: Optional[str]) -> Path:
+        sources = self._sources(spec)
+        if not sources:
+            raise WeightsUnavailable(
+                f"{target} is missing and EMOTION_WEIGHTS_OFFLINE is set; "
+                "copy the file there or point EMOTION_WEIGHTS_MIRROR at a local directory"
+            )
+        part = target.with_name(target.name + ".part")
+        errors = []
+        for source in sources:
+            started = time.perf_counter()
+            try:
+                digest = expected or self._mirror_digest(source)
+                if _is_http(source):
+                    self._download(source, part)
+                else:
+                    self._copy(source, part)
+                actual = _sha256(part)
+                if digest and actual != digest:
+                    part.unlink()
+                    raise ValueError(f"checksum mismatch: got {actual}, expected {digest}")
+                if not digest and not _looks_complete(part, spec.filename):
+                    part.unlink()
+                    raise ValueError("downloaded file is truncated or corrupt")
+            except (OSError, ValueError, requests.RequestException) as exc:
+                logger.warning("Cannot fetch %s from %s: %s", spec.filename, source, exc)
+                errors.append(f"{source}: {exc}")
+                continue
+            os.replace(part, target)
+            if digest:
+                self._record(target, digest)
+            else:
+                logger.warning(
+                    "Fetched %s without a checksum to verify it against", spec.filename
+                )
+            logger.info(
+                "Fetched %s from %s in %.1fs", spec.filename, source, time.perf_counter() - started
+            )
+            return target
+        raise WeightsUnavailable(f"Cannot fetch {spec.filename}: " + "; ".join(errors))
+
+    def _mirror_digest(self, source: Optional[str]) -> Optional[str]:
+        if not self.mirror or not source or not source.startswith(self.mirror):
+            return None
+        sidecar = source + ".sha256"
+        if self.offline and _is_http(sidecar):
+            return None
+        try:
+            if _is_http(sidecar):
+                response = requests.get(sidecar, timeout=self.timeout)
+                return _read_digest(response.text) if response.ok else None
+            path = _local_path(sidecar)
+            return _read_digest(path.read_text()) if path.exists() else None
+        except (OSError, requests.RequestException):
+            return None
+
+    def _copy(self, source: str, part: Path) -> None:
+        with _local_path(source).open("rb") as src, part.open("wb") as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+            dst.flush()
+            os.fsync(dst.fileno())
+
+    def _download(self, url: str, part: Path) -> None:
+        for attempt in range(1, self.retries + 1):
+            offset = part.stat().st_size if part.exists() else 0
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            try:
+                with requests.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                    if response.status_code == 416:
+                        # Range за концом файла: .part либо уже целиком
+                        # скачан, либо длиннее оригинала и испорчен.
+                        if offset == _range_total(response):
+                            return
+                        logger.warning("Discarding %s: resume rejected at %d bytes", part, offset)
+                        part.unlink()
+                        continue
+                    response.raise_for_status()
+                    # 200 на запрос с Range: сервер не умеет докачку, начинаем заново.
+                    mode = "ab" if response.status_code == 206 else "wb"
+                    with part.open(mode) as handle:
+                        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                            handle.write(chunk)
+                        handle.flush()
+                        os.fsync(handle.fileno())
+                return
+            except (OSError, requests.RequestException) as exc:
+                if attempt == self.retries:
+                    raise
+                logger.warning(
+                    "Download of %s interrupted at %d bytes (%s), resuming",
+                    url,
+                    part.stat().st_size if part.exists() else 0,
+                    exc,
+                )
+                time.sleep(attempt)
+
+    @contextmanager
+    def _locked(self, target: Path) -> Iterator[None]:
+        # Несколько воркеров на узле стартуют одновременно: качает один.
+        if fcntl is None:
+            yield
+            return
+        with target.with_name(target.name + ".lock").open("w") as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _range_total(response: requests.Response) -> Optional[int]:
+    # Content-Range у 416: "bytes */<размер>".
+    _, _, total = response.headers.get("Content-Range", "").rpartition("/")
+    return int(total) if total.isdigit() else None
+
+
+def _is_http(source: str) -> bool:
+    return source.startswith(("http://", "https://"))
+
+
+def _local_path(source: str) -> Path:
+    return Path(urlparse(source).path) if source.startswith("file://") else Path(source)